@@ -1,8 +1,65 @@
 import streamlit as st
 import requests
-import jwt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+from concurrent.futures import ThreadPoolExecutor, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import orjson
+import base64
 
 API_URL = "http://localhost:8000"  # Change to your FastAPI host if different
+STREAM_DIRECT_CHAT = True  # Set to False if the backend has no /query/direct/stream endpoint
+EMBEDDING_MODELS = ("text-embedding-3-small", "gemma2:latest", "llama3.2:latest")
+
+
+# ----------------------------
+# Utility: HTTP Session
+# ----------------------------
+@st.cache_resource
+def get_session():
+    # One pooled session per server process so reruns reuse open connections
+    session = requests.Session()
+    # Room for the parallel fan-out; only idempotent requests are retried on gateway errors
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=100,
+                          max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = get_session()
+
+
+@st.cache_resource
+def get_executor():
+    # Background pool for calls whose result the current rerun doesn't need
+    return ThreadPoolExecutor(max_workers=4)
+
+
+def submit_with_ctx(fn, *args):
+    # Attach this session's script context to the worker so st.cache_data functions behave as on the script thread
+    ctx = get_script_run_ctx()
+
+    def run():
+        add_script_run_ctx(ctx=ctx)
+        return fn(*args)
+
+    return get_executor().submit(run)
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def unverified_claims(token):
+    # The frontend only reads claims; the backend verifies the signature on every request
+    return orjson.loads(base64.urlsafe_b64decode(token.split(".")[1] + "=="))
+
+
+def auth_headers():
+    # The session is shared by every user of this process, so the header built at login travels per call
+    return st.session_state.get("auth_header", {})
 
 
 # ----------------------------
@@ -15,16 +72,17 @@ def login(username: str, password: str):
             'password': password,
             'grant_type': 'password',
         }
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(f"{API_URL}/token", data=data, headers=headers)
+        response = SESSION.post(f"{API_URL}/token", data=data)
 
         if response.status_code == 200:
             token_data = response.json()
             st.session_state.token = token_data["access_token"]
+            st.session_state.auth_header = bearer(token_data["access_token"])
             st.session_state.username = username
 
-            # Decode token
-            decoded = jwt.decode(token_data["access_token"], options={"verify_signature": False})
+            # Decode token once; later reruns read the stored claims
+            decoded = unverified_claims(token_data["access_token"])
+            st.session_state.decoded = decoded
             st.session_state.user_id = decoded.get("sub")
             st.success("✅ Login successful!")
             st.rerun()
@@ -45,7 +103,7 @@ def signup(username, full_name, email, password):
         "password": password
     }
     try:
-        resp = requests.post(f"{API_URL}/signup", json=data)
+        resp = SESSION.post(f"{API_URL}/signup", json=data)
         if resp.status_code == 200:
             st.success("🎉 Account created! Please log in.")
         else:
@@ -93,19 +151,47 @@ user_id = st.session_state.user_id
 # --- Sidebar ---
 st.sidebar.header(f"👋 Hello, {user_id}")
 if st.sidebar.button("🚪 Logout"):
-    for key in ["token", "username", "user_id", "current_conversation_id"]:
+    for key in ["token", "auth_header", "decoded", "username", "user_id", "current_conversation_id",
+                "messages", "messages_conversation_id", "rag_sources"]:
         st.session_state.pop(key, None)
     st.rerun()
 
 
 # Conversation management
-def fetch_conversations(user_id):
-    resp = requests.get(f"{API_URL}/conversations", params={"user_id": user_id})
-    return resp.json() if resp.status_code == 200 else []
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_conversations(user_id, token):
+    resp = SESSION.get(f"{API_URL}/conversations", params={"user_id": user_id}, headers=bearer(token))
+    return orjson.loads(resp.content) if resp.status_code == 200 else []
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_knowledge_bases(token):
+    resp = SESSION.get(f"{API_URL}/knowledge_bases", headers=bearer(token))
+    return orjson.loads(resp.content) if resp.status_code == 200 else []
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_compatible_kbs(models, token):
+    # Probe every model at once; the header is built here because worker threads can't read session_state
+    headers = bearer(token)
+    url = f"{API_URL}/knowledge_bases/compatible"
+
+    def fetch(model):
+        resp = SESSION.get(url, params={"embedding_model": model}, headers=headers)
+        return model, orjson.loads(resp.content) if resp.status_code == 200 else []
+
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        return dict(executor.map(fetch, models))
+
+
+@st.cache_data(show_spinner=False)
+def _conv_options(convs_tuple):
+    return {f"{title} ({conv_id})": conv_id for conv_id, title in convs_tuple}
 
 
 def create_conversation(user_id, title="New Chat"):
-    resp = requests.post(f"{API_URL}/create/conversations", json={"user_id": user_id, "title": title})
+    resp = SESSION.post(f"{API_URL}/create/conversations", json={"user_id": user_id, "title": title},
+                        headers=auth_headers())
     return resp.json() if resp.status_code == 200 else None
 
 
@@ -113,23 +199,76 @@ if st.sidebar.button("New Conversation"):
     conv = create_conversation(user_id)
     if conv:
         st.session_state["current_conversation_id"] = conv["id"]
+        fetch_conversations.clear()
+
+# Pick up the title update submitted by the previous send once it has finished
+title_future = st.session_state.get("title_future")
+if title_future is not None and title_future.done():
+    st.session_state.pop("title_future")
+    try:
+        title_resp = title_future.result(timeout=0)
+        if title_resp.status_code == 200:
+            st.session_state["updated_title"] = title_resp.json()["title"]
+            fetch_conversations.clear()
+    except requests.RequestException:
+        pass
+
 
-convs = fetch_conversations(user_id)
-conv_options = {f"{c['title']} ({c['id']})": c["id"] for c in convs}
+@st.fragment(run_every=1)
+def title_watcher():
+    # Rerun the whole app once the title update lands, so the conversation selectbox shows it
+    title_future = st.session_state.get("title_future")
+    if title_future is None or title_future.done():
+        st.rerun()
+
+
+if st.session_state.get("title_future") is not None:
+    title_watcher()
+
+# Start the independent GETs together; they fill the caches above, so later calls wait on them instead of re-sending
+preload = {
+    "conversations": submit_with_ctx(fetch_conversations, user_id, st.session_state.token),
+    "knowledge_bases": submit_with_ctx(fetch_knowledge_bases, st.session_state.token),
+    "compatible_kbs": submit_with_ctx(fetch_compatible_kbs, EMBEDDING_MODELS, st.session_state.token),
+}
+
+convs = preload["conversations"].result()
+conv_options = _conv_options(tuple((c["id"], c["title"]) for c in convs))
 selected_conv = st.sidebar.selectbox("Select Conversation", list(conv_options.keys()))
 current_conversation_id = conv_options[selected_conv] if selected_conv else None
 st.session_state["current_conversation_id"] = current_conversation_id
 
 
 # Fetch and display messages
-def fetch_messages(conversation_id):
-    resp = requests.get(f"{API_URL}/messages", params={"conversation_id": conversation_id})
-    return resp.json() if resp.status_code == 200 else []
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_messages(conversation_id, token):
+    resp = SESSION.get(f"{API_URL}/messages", params={"conversation_id": conversation_id}, headers=bearer(token))
+    return orjson.loads(resp.content) if resp.status_code == 200 else []
+
+
+def last_message_id():
+    return st.session_state.messages[-1]["id"] if st.session_state.messages else None
+
+
+def append_messages(new_messages):
+    # Apply the delta returned by the API instead of re-fetching the whole history
+    if not new_messages:
+        # No delta arrived (the stream was cut off), so reload the conversation on the next run instead
+        fetch_messages.clear()
+        st.session_state.pop("messages_conversation_id", None)
+        return False
+    st.session_state.messages.extend(new_messages)
+    # The first message of a conversation renames it
+    fetch_conversations.clear()
+    return True
 
 
 st.subheader(f"Conversation: {selected_conv}")
-messages = fetch_messages(current_conversation_id)
-for msg in messages:
+# Messages are loaded once per conversation; sends append what the API returns
+if st.session_state.get("messages_conversation_id") != current_conversation_id:
+    st.session_state.messages = fetch_messages(current_conversation_id, st.session_state.token)
+    st.session_state.messages_conversation_id = current_conversation_id
+for msg in st.session_state.messages:
     role = msg["role"]
     content = msg["content"]
     user_name = msg.get("user_name", "User")
@@ -139,89 +278,156 @@ for msg in messages:
         st.markdown(f"**Assistant:** {content}")
 
 # --- Direct Chat ---
-st.markdown("---")
-st.markdown("### Send a Message (Direct Chat)")
-user_input = st.text_input("Your message", key="user_input")
-model_name = st.selectbox("Model", ["gpt-4o-mini", "gemma2:latest", "llama3.2:latest"], index=0)
-if st.button("Send (Direct Chat)") and user_input:
-    payload = {
-        "conversation_id": current_conversation_id,
-        "query": user_input,
-        "model_name": model_name
-    }
-    resp = requests.post(f"{API_URL}/query/direct", json=payload)
-    if resp.status_code == 200:
-        assistant_reply = resp.json()["response"]
-        st.markdown(f"**Assistant:** {assistant_reply}")
-        title_resp = requests.put(f"{API_URL}/update/conversations/{current_conversation_id}/title")
-        if title_resp.status_code == 200:
-            st.session_state["updated_title"] = title_resp.json()["title"]
-    else:
-        st.error(f"Error: {resp.text}")
+def stream_reply(resp):
+    # Render SSE "data:" events as they arrive; the body is read to the end so the connection returns to the pool
+    placeholder = st.empty()
+    reply = ""
+    new_messages = []
+    failed = False
+    try:
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                continue
+            event = orjson.loads(data)
+            if "messages" in event:
+                new_messages = event["messages"]
+                continue
+            if "error" in event:
+                st.error(f"Error: {event['error']}")
+                failed = True
+                continue
+            reply += event["delta"]
+            placeholder.markdown(f"**Assistant:** {reply}")
+    except requests.RequestException as e:
+        st.error(f"Error: the reply stream was interrupted ({e})")
+        failed = True
+    return reply, new_messages, failed
+
+
+# Each chat section is a fragment, so typing or picking options there reruns only that section
+@st.fragment
+def direct_chat():
+    st.markdown("### Send a Message (Direct Chat)")
+    user_input = st.text_input("Your message", key="user_input")
+    model_name = st.selectbox("Model", ["gpt-4o-mini", "gemma2:latest", "llama3.2:latest"], index=0)
+    if st.button("Send (Direct Chat)") and user_input:
+        payload = {
+            "conversation_id": current_conversation_id,
+            "query": user_input,
+            "model_name": model_name,
+            "last_message_id": last_message_id()
+        }
+        endpoint = "/query/direct/stream" if STREAM_DIRECT_CHAT else "/query/direct"
+        resp = SESSION.post(f"{API_URL}{endpoint}", json=payload, headers=auth_headers(), stream=STREAM_DIRECT_CHAT)
+        if resp.status_code == 200:
+            if STREAM_DIRECT_CHAT:
+                assistant_reply, new_messages, failed = stream_reply(resp)
+            else:
+                result = resp.json()
+                assistant_reply, new_messages, failed = result["response"], result["messages"], False
+                st.markdown(f"**Assistant:** {assistant_reply}")
+            stored = append_messages(new_messages)
+            # Fire-and-forget: the new title is picked up on the next rerun
+            st.session_state["title_future"] = get_executor().submit(
+                SESSION.put, f"{API_URL}/update/conversations/{current_conversation_id}/title",
+                headers=auth_headers())
+            # The message list and conversation picker render outside this fragment, so redraw the app once
+            # the turn is in session state. After an error, keep the message and the partial reply on screen;
+            # the next run reloads the conversation
+            if stored and not failed:
+                st.rerun()
+        else:
+            st.error(f"Error: {resp.text}")
+
 
 # --- RAG Chat ---
-st.markdown("### Send a Message (RAG)")
-rag_input = st.text_input("Your message (RAG)", key="rag_input")
-
-kbs = requests.get(f"{API_URL}/knowledge_bases").json()
-kbs_names = [kb["name"] for kb in kbs]
-selected_kb = st.selectbox("Select KB", kbs_names)
-
-embedding_models = ["text-embedding-3-small", "gemma2:latest", "llama3.2:latest"]
-compatible_model = None
-for model in embedding_models:
-    compatible_kbs = requests.get(f"{API_URL}/knowledge_bases/compatible", params={"embedding_model": model}).json()
-    if selected_kb in compatible_kbs:
-        compatible_model = model
-        break
-
-embedding_model = st.selectbox("Embedding Model", embedding_models,
-                               index=embedding_models.index(compatible_model) if compatible_model else 0, disabled=True)
-chat_model_map = {
-    "text-embedding-3-small": "gpt-4o-mini",
-    "gemma2:latest": "gemma2:latest",
-    "llama3.2:latest": "llama3.2:latest"
-}
-chat_model = chat_model_map.get(embedding_model, "gpt-4o-mini")
-st.text(f"Chat Model: {chat_model} (auto-selected)")
-retrieval_k = st.number_input("Top K Chunks", min_value=1, max_value=10, value=4)
-
-if st.button("Send (RAG)") and rag_input:
-    payload = {
-        "conversation_id": current_conversation_id,
-        "query": rag_input,
-        "kb_names": [selected_kb],
-        "embedding_model": embedding_model,
-        "chat_model": chat_model,
-        "retrieval_k": retrieval_k
+@st.fragment
+def rag_chat():
+    st.markdown("### Send a Message (RAG)")
+    rag_input = st.text_input("Your message (RAG)", key="rag_input")
+
+    # Cache hits: a full run has waited for the preload to fill them, and a fragment rerun must not read
+    # that run's futures, which can be older than the cache TTL
+    kbs = fetch_knowledge_bases(st.session_state.token)
+    kbs_names = [kb["name"] for kb in kbs]
+    selected_kb = st.selectbox("Select KB", kbs_names)
+
+    embedding_models = list(EMBEDDING_MODELS)
+    compatible_by_model = fetch_compatible_kbs(EMBEDDING_MODELS, st.session_state.token)
+    compatible_model = next((m for m in EMBEDDING_MODELS if selected_kb in compatible_by_model[m]), None)
+
+    embedding_model = st.selectbox("Embedding Model", embedding_models,
+                                   index=embedding_models.index(compatible_model) if compatible_model else 0,
+                                   disabled=True)
+    chat_model_map = {
+        "text-embedding-3-small": "gpt-4o-mini",
+        "gemma2:latest": "gemma2:latest",
+        "llama3.2:latest": "llama3.2:latest"
     }
-    resp = requests.post(f"{API_URL}/query/rag", json=payload)
-    if resp.status_code == 200:
-        result = resp.json()
-        st.markdown(f"**RAG Response:** {result['response']}")
-        if result.get("sources"):
-            st.markdown("**Sources:**")
-            for src in result["sources"]:
-                st.markdown(f"- {src['source']} (Page {src['page']}, Score: {src['score']})")
-    else:
-        st.error(f"Error: {resp.text}")
+    chat_model = chat_model_map.get(embedding_model, "gpt-4o-mini")
+    st.text(f"Chat Model: {chat_model} (auto-selected)")
+    retrieval_k = st.number_input("Top K Chunks", min_value=1, max_value=10, value=4)
+
+    if st.button("Send (RAG)") and rag_input:
+        payload = {
+            "conversation_id": current_conversation_id,
+            "query": rag_input,
+            "kb_names": [selected_kb],
+            "embedding_model": embedding_model,
+            "chat_model": chat_model,
+            "retrieval_k": retrieval_k,
+            "last_message_id": last_message_id()
+        }
+        resp = SESSION.post(f"{API_URL}/query/rag", json=payload, headers=auth_headers())
+        if resp.status_code == 200:
+            result = resp.json()
+            # Kept for the rerun below, which redraws the message list and conversation picker
+            st.session_state["rag_sources"] = (current_conversation_id, result.get("sources") or [])
+            if append_messages(result["messages"]):
+                st.rerun()
+        else:
+            st.error(f"Error: {resp.text}")
+
+    # Sources of the last RAG answer in this conversation; the answer itself is in the message list
+    sources_conversation_id, sources = st.session_state.get("rag_sources", (None, []))
+    if sources and sources_conversation_id == current_conversation_id:
+        st.markdown("**Sources:**")
+        for src in sources:
+            st.markdown(f"- {src['source']} (Page {src['page']}, Score: {src['score']})")
+
+
+st.markdown("---")
+# Let the preload finish filling the caches before the chat sections read them
+wait(preload.values())
+direct_chat()
+rag_chat()
 
 # --- Upload File ---
 uploaded_file = st.file_uploader("Upload a document", type=["pdf", "docx"])
 
 if uploaded_file:
-    embedding_model = st.selectbox("Embedding Model", ["text-embedding-3-small", "gemma2:latest", "llama3.2:latest"])
+    embedding_model = st.selectbox("Embedding Model", EMBEDDING_MODELS)
     chunking_strategy = st.selectbox("Chunking Strategy", ["semantic_percentile", "recursive"])
     if st.button("Upload to KB"):
-        files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-        data = {
+        # Stream the body from the uploaded file in small reads instead of building it in memory
+        encoder = MultipartEncoder(fields={
+            "file": (uploaded_file.name, uploaded_file, uploaded_file.type),
             "embedding_model_name": embedding_model,
             "chunking_strategy_name": chunking_strategy,
-            "chunk_size": 1000,
-            "chunk_overlap": 200
-        }
-        resp = requests.post(f"{API_URL}/upload", files=files, data=data)
+            "chunk_size": "1000",
+            "chunk_overlap": "200"
+        })
+        progress = st.progress(0.0, text="Uploading...")
+        monitor = MultipartEncoderMonitor(
+            encoder, lambda m: progress.progress(min(m.bytes_read / m.len, 1.0), text="Uploading..."))
+        resp = SESSION.post(f"{API_URL}/upload", data=monitor,
+                            headers={**auth_headers(), "Content-Type": monitor.content_type})
         if resp.status_code == 200:
+            fetch_knowledge_bases.clear()
+            fetch_compatible_kbs.clear()
             st.success("✅ File uploaded and processed!")
             st.json(resp.json())
         else:
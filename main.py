@@ -5,9 +5,12 @@ import yaml
 from yaml.loader import SafeLoader
 import time
 import uuid
+import hashlib
 import base64
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import groupby
 from io import BytesIO
 
 # Import utility modules
@@ -16,23 +19,27 @@ from utils.database import (
     create_conversation,
     get_messages,
     add_message,
+    add_message_and_maybe_retitle,
     add_sources,
     get_sources,
-    update_conversation_title,
     delete_conversation,
     get_setting,
     set_setting,
     get_active_knowledge_base,
     set_active_knowledge_base,
+    get_document_hash_kb,
+    add_document_hash,
+    get_session_bootstrap,
     init_database
 )
 
 from utils.document_processing import (
-    process_and_chunk_file,
+    process_and_chunk_files_batched,
     get_all_knowledge_base_names,
     kb_exists,
     auto_create_knowledge_base_if_needed,
     get_compatible_knowledge_bases,
+    get_compatible_embedding_model,
     ChunkingStrategy,
     EmbeddingModel,
     ChatModel
@@ -41,12 +48,19 @@ from utils.document_processing import (
 from utils.chat import (
     load_settings,
     process_query,
+    process_query_cached,
+    invalidate_semantic_cache,
     get_suggested_prompts,
-    direct_openai_query
+    direct_openai_query,
+    stream_direct_query
 )
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger("rag-chatbot")
 
+RECENT_CONVERSATION_LIMIT = 30
+MESSAGE_PAGE_SIZE = 50
+
 # Page configuration
 st.set_page_config(
     page_title="RAG Chatbot",
@@ -56,8 +70,159 @@ st.set_page_config(
 )
 
 
+# Cached readers; call the matching .clear() after any write that changes their result
+@st.cache_data(ttl=30, show_spinner=False)
+def get_conversations_cached(user_name=None):
+    return get_conversations(user_name)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_all_knowledge_base_names_cached():
+    return get_all_knowledge_base_names()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_compatible_knowledge_bases_cached(embedding_model):
+    return get_compatible_knowledge_bases(embedding_model)
+
+
+def with_display_times(messages):
+    """Append the rendered "%H:%M" time to each message row, so reruns never call strftime"""
+    return [(*message, message[4].strftime("%H:%M")) for message in messages]
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_recent_messages_cached(conversation_id):
+    return with_display_times(get_messages(conversation_id, limit=MESSAGE_PAGE_SIZE, include_system=False))
+
+
+# Source card markup; relevance tier colours live in the .source-card rules of style.css
+SOURCE_CARD_TEMPLATE = (
+    "<div class='source-card {tier}'>"
+    "<div class='source-title'>{index}. {source}</div>"
+    "<div class='source-meta'>"
+    "<span class='source-kb'>KB: {kb_name}</span>"
+    "<span class='source-page'>Page {page}</span>"
+    "<span class='source-relevance'>Relevance: {percent}%</span>"
+    "</div></div>"
+)
+COMPACT_SOURCE_CARD_TEMPLATE = (
+    "<div class='source-card compact {tier}'>"
+    "<div class='source-title'>{index}. {source}</div>"
+    "<div class='source-meta'>"
+    "<span>Page {page}</span>"
+    "<span class='source-relevance'>Relevance: {percent}%</span>"
+    "</div></div>"
+)
+
+
+def _source_card_fields(index, source):
+    percent = int(source.get('score', 0) * 100)
+    return {
+        "tier": "high" if percent >= 70 else "med" if percent >= 50 else "low",
+        "index": index,
+        "source": source.get('source', 'Unknown'),
+        "kb_name": source.get('kb_name', 'Unknown KB'),
+        "page": source.get('page', 0),
+        "percent": percent,
+    }
+
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def render_source_cards(msg_id):
+    """A message's source cards as HTML, built once: (by relevance, grouped by KB), or None without sources"""
+    # Rows arrive ordered by KB, document and page, best score first within each page. add_sources
+    # stores one row per page, but messages saved before it did may still hold duplicates
+    sources = get_sources(msg_id)
+    if not sources:
+        return None
+
+    unique_sources = {}
+    kb_parts = []
+    for kb_name, kb_sources in groupby(sources, key=lambda source: source['kb_name']):
+        kb_parts.append(f"<h3>{kb_name}</h3>")
+        seen = set()
+        for source in kb_sources:
+            key = (source['source'], source['page'])
+            if key in seen:
+                continue
+            seen.add(key)
+            kb_parts.append(COMPACT_SOURCE_CARD_TEMPLATE.format_map(_source_card_fields(len(seen), source)))
+            # Across KBs keep only the highest scoring hit for each document page
+            if key not in unique_sources or source['score'] > unique_sources[key]['score']:
+                unique_sources[key] = source
+        kb_parts.append("<hr>")
+
+    sorted_sources = sorted(unique_sources.values(), key=lambda x: x['score'], reverse=True)
+    relevant_html = "".join(SOURCE_CARD_TEMPLATE.format_map(_source_card_fields(i, source))
+                            for i, source in enumerate(sorted_sources, 1))
+    return relevant_html, "".join(kb_parts)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_suggestion_columns():
+    """Suggested prompts as (label, key, prompt) buttons, split into the left and right columns"""
+    buttons = [(f"💡 {s}", f"sugg_{i}", s) for i, s in enumerate(get_suggested_prompts())]
+    return buttons[0::2], buttons[1::2]
+
+
+@st.cache_resource
+def get_chat_model_options():
+    # The main script re-executes on every rerun, so build the option list and its index map once here
+    options = ["__select__"] + [model.value for model in ChatModel]
+    return options, {value: i for i, value in enumerate(options)}
+
+
+@st.cache_resource(show_spinner=False)
+def init_database_once():
+    # Table creation only needs to happen once per server process; a failure isn't cached and is retried
+    init_database()
+    logger.info("Database tables initialized successfully")
+    return True
+
+
+@st.cache_resource
+def get_upload_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+
+@st.cache_resource
+def get_query_executor():
+    # Shared by all sessions so slow model calls don't hold the script thread
+    return ThreadPoolExecutor(max_workers=8)
+
+
+def load_recent_messages(conversation_id, fresh=False):
+    """Load the newest page of a conversation's messages into the session
+
+    Pass fresh=True after writing to the conversation so the cached page is dropped first.
+    """
+    if fresh:
+        get_recent_messages_cached.clear()
+    st.session_state.messages = get_recent_messages_cached(conversation_id)
+    st.session_state.has_earlier_messages = len(st.session_state.messages) == MESSAGE_PAGE_SIZE
+
+
+def refresh_conversations(user_name):
+    get_conversations_cached.clear()
+    st.session_state.conversations = get_conversations_cached(user_name)
+
+
 # Custom CSS
-import streamlit as st
+# Only the rules the app's own markup needs (the source cards); the full assets/style.css theme is not applied
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "source_cards.css")
+
+
+@st.cache_resource
+def _get_css():
+    # Read the stylesheet once per server process instead of on every rerun
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
+
+def add_custom_css():
+    st.markdown(_get_css(), unsafe_allow_html=True)
+
 
 def api_key_required_screen():
     st.error("⚠️ OpenAI API Key Required")
@@ -121,41 +286,54 @@ def init_session_state():
     logger.info("Initializing session state")
 
     try:
-        init_database()
-        logger.info("Database tables initialized successfully")
+        init_database_once()
     except Exception as e:
-        logger.error(f"Failed to initialize database: {e}")
+        logger.error("Failed to initialize database: %s", e)
         st.error(f"Database initialization failed: {e}")
         return
 
     # Get current user
     current_user = st.session_state.get('username', 'admin')
 
-    # ALWAYS refresh conversations from database (don't cache)
-    st.session_state.conversations = get_conversations(current_user)
-    logger.debug(f"Loaded {len(st.session_state.conversations)} conversations for user: {current_user}")
+    # A new session reads its conversations, messages and active KB over one connection;
+    # later runs refresh conversations from the cache, which writes clear
+    boot = None
+    if "messages" not in st.session_state:
+        boot = get_session_bootstrap(current_user, st.session_state.get("current_conversation_id"),
+                                     message_limit=MESSAGE_PAGE_SIZE)
+        st.session_state.conversations = boot["conversations"]
+    else:
+        st.session_state.conversations = get_conversations_cached(current_user)
+    logger.debug("Loaded %s conversations for user: %s", len(st.session_state.conversations), current_user)
 
     # CRITICAL FIX: Ensure current_conversation_id is set
     if "current_conversation_id" not in st.session_state:
         # Create a new conversation if none exists
         if not st.session_state.conversations:
-            logger.info(f"No conversations found for {current_user}, creating a new one")
+            logger.info("No conversations found for %s, creating a new one", current_user)
             new_id = create_conversation(created_by=current_user)
-            st.session_state.conversations = get_conversations(current_user)
+            refresh_conversations(current_user)
             st.session_state.current_conversation_id = new_id
         else:
-            logger.info(f"Setting current conversation to first in list for {current_user}")
+            logger.info("Setting current conversation to first in list for %s", current_user)
             st.session_state.current_conversation_id = st.session_state.conversations[0][0]
 
     # ENSURE messages are loaded for current conversation
     if "messages" not in st.session_state:
-        st.session_state.messages = get_messages(st.session_state.current_conversation_id)
+        if boot and boot["conversation_id"] == st.session_state.current_conversation_id:
+            st.session_state.messages = with_display_times(boot["messages"])
+            st.session_state.has_earlier_messages = len(boot["messages"]) == MESSAGE_PAGE_SIZE
+        else:
+            load_recent_messages(st.session_state.current_conversation_id)
         logger.debug(
-            f"Loaded {len(st.session_state.messages)} messages for conversation {st.session_state.current_conversation_id}")
+            "Loaded %s messages for conversation %s", len(st.session_state.messages), st.session_state.current_conversation_id)
 
     if "settings" not in st.session_state:
         st.session_state.settings = load_settings()
-        logger.debug(f"Loaded settings: {st.session_state.settings}")
+        logger.debug("Loaded settings: %s", st.session_state.settings)
+
+    if "semantic_cache_enabled" not in st.session_state:
+        st.session_state.semantic_cache_enabled = st.session_state.settings.get("semantic_cache", {}).get("enabled", False)
 
     if "openai_key_configured" not in st.session_state:
         key = st.session_state.settings.get("openai_key")
@@ -167,22 +345,33 @@ def init_session_state():
             st.session_state.openai_key_configured = False
             logger.warning("OpenAI API key not configured")
 
+    # Restore the KB choice carried in the URL, keeping only names of knowledge bases that exist;
+    # the sidebar further drops any that are not compatible with the chat model
+    url_needed = "active_kb" not in st.session_state or "selected_kbs" not in st.session_state
+    known_kbs = set(get_all_knowledge_base_names_cached()) if url_needed else set()
+    if "active_kb" not in st.session_state and st.query_params.get("active") in known_kbs:
+        st.session_state.active_kb = st.query_params["active"]
     if "active_kb" not in st.session_state:
         # Get active knowledge base from database
-        active_kb = get_active_knowledge_base()
+        active_kb = boot["active_kb"] if boot else get_active_knowledge_base()
         if active_kb:
             st.session_state.active_kb = active_kb["name"]
-            logger.info(f"Active knowledge base set to: {st.session_state.active_kb}")
+            logger.info("Active knowledge base set to: %s", st.session_state.active_kb)
         else:
             # Auto-create a knowledge base if none exists
             logger.info("No active knowledge base, creating default")
             kb_name = auto_create_knowledge_base_if_needed()
+            get_all_knowledge_base_names_cached.clear()
             st.session_state.active_kb = kb_name
             set_active_knowledge_base(kb_name)
 
     # For multiple KB selection
     if "selected_kbs" not in st.session_state:
-        st.session_state.selected_kbs = [st.session_state.active_kb] if st.session_state.active_kb else []
+        url_kbs = [kb for kb in st.query_params.get_all("kbs") if kb in known_kbs]
+        if url_kbs:
+            st.session_state.selected_kbs = url_kbs
+        else:
+            st.session_state.selected_kbs = [st.session_state.active_kb] if st.session_state.active_kb else []
 
     if "show_sources" not in st.session_state:
         st.session_state.show_sources = True
@@ -190,6 +379,9 @@ def init_session_state():
     if "is_thinking" not in st.session_state:
         st.session_state.is_thinking = False
 
+    if "pending_query" not in st.session_state:
+        st.session_state.pending_query = None
+
     if "processing_file" not in st.session_state:
         st.session_state.processing_file = False
 
@@ -204,7 +396,14 @@ def init_session_state():
         st.session_state.processed_files = set()
 
     if "kb_names" not in st.session_state:
-        st.session_state.kb_names = get_all_knowledge_base_names()
+        st.session_state.kb_names = get_all_knowledge_base_names_cached()
+
+
+def file_sha256(file):
+    """Hash an uploaded file's content without copying it."""
+    # UploadedFile is a BytesIO, so its buffer can be hashed in place; release the view so the file stays usable
+    with file.getbuffer() as view:
+        return hashlib.sha256(view).hexdigest()
 
 
 def process_uploaded_files(uploaded_files, embedding_model, chunking_strategy):
@@ -218,118 +417,298 @@ def process_uploaded_files(uploaded_files, embedding_model, chunking_strategy):
     # Keep track of processed file names to avoid reprocessing
     if "processed_files" not in st.session_state:
         st.session_state.processed_files = set()
+    # Content hash per upload; files stay in the uploader across reruns, so each is hashed once
+    upload_hashes = st.session_state.setdefault("upload_hashes", {})
+    current_user = st.session_state.get('username', 'admin')
 
     # Get list of files to process (filter already processed ones)
     files_to_process = []
+    already_indexed = []
     for file in uploaded_files:
-        # Create a unique identifier for the file based on name and size
-        file_id = f"{file.name}_{len(file.getvalue())}"
-        if file_id not in st.session_state.processed_files:
-            files_to_process.append((file, file_id))
+        # Identify the file by its content so renamed copies are recognised too
+        file_id = upload_hashes.get(file.file_id)
+        if file_id is None:
+            file_id = upload_hashes[file.file_id] = file_sha256(file)
+        if file_id in st.session_state.processed_files:
+            continue
+
+        existing_kb = get_document_hash_kb(file_id, embedding_model, current_user)
+        if existing_kb:
+            logger.info("Skipping %s: identical content already indexed in %s", file.name, existing_kb)
+            st.session_state.processed_files.add(file_id)
+            if existing_kb not in st.session_state.selected_kbs:
+                st.session_state.selected_kbs.append(existing_kb)
+            already_indexed.append(f"{file.name} is already indexed in {existing_kb}")
+            continue
+
+        files_to_process.append((file, file_id))
+
+    if already_indexed:
+        st.session_state.upload_status = {
+            "type": "success",
+            "message": "✅ " + "; ".join(already_indexed)
+        }
 
     if not files_to_process:
         st.session_state.processing_file = False
         return
 
-    logger.info(f"Processing {len(files_to_process)} new uploaded files")
-    logger.info(f"Using embedding model: {embedding_model}, chunking strategy: {chunking_strategy}")
+    logger.info("Processing %s new uploaded files", len(files_to_process))
+    logger.info("Using embedding model: %s, chunking strategy: %s", embedding_model, chunking_strategy)
+
+    # Chunk every file first, then embed all chunks together in shared batches
+    kb_names = []
+    for file, file_id in files_to_process:
+        logger.info("Processing file: %s", file.name)
+
+        # Mark as processed
+        st.session_state.processed_files.add(file_id)
+
+        # Generate KB name from filename
+        base_name = os.path.splitext(file.name)[0].lower().replace(' ', '_')
+        kb_name = f"kb_{base_name}"
+        kb_names.append(kb_name)
+
+        logger.debug("File size: %s bytes", file.size)
+        logger.debug("Knowledge base name: %s", kb_name)
+
+    # Chunking and embedding run on a worker thread so the chat stays responsive;
+    # apply_upload_results() picks up the outcome on a later rerun
+    future = get_upload_executor().submit(
+        process_and_chunk_files_batched,
+        files=[file for file, _ in files_to_process],
+        kb_names=kb_names,
+        embedding_model_name=embedding_model,  # Use user selection
+        chunking_strategy_name=chunking_strategy  # Use user selection
+    )
+    st.session_state.upload_job = {
+        "future": future,
+        "files": [(file.name, file_id) for file, file_id in files_to_process],
+        "kb_names": kb_names,
+        "embedding_model": embedding_model,
+        "chunking_strategy": chunking_strategy,
+        "created_by": current_user
+    }
+
+
+def apply_upload_results():
+    """Apply the results of a finished background upload to the session"""
+    job = st.session_state.get("upload_job")
+    if job is None or not job["future"].done():
+        return
+
+    st.session_state.upload_job = None
+    embedding_model = job["embedding_model"]
+    chunking_strategy = job["chunking_strategy"]
+    try:
+        results = job["future"].result()
+    except Exception as e:
+        logger.exception("Background upload failed: %s", str(e))
+        results = [{"status": "error", "message": str(e)} for _ in job["files"]]
 
     success_count = 0
     error_count = 0
     new_kb_created = False
     newly_created_kbs = []
+    # Collected per file and written to upload_status once at the end
+    error_messages = []
+    selected_set = set(st.session_state.selected_kbs)
+    known_set = set(st.session_state.kb_names)
+
+    for (file_name, file_id), kb_name, result in zip(job["files"], job["kb_names"], results):
+        if result["status"] == "success":
+            logger.info("Successfully processed %s: %s chunks", file_name, result['chunk_count'])
+            add_document_hash(file_id, embedding_model, kb_name, job["created_by"])
+
+            # Add the new KB to the list of selected KBs
+            if kb_name not in selected_set:
+                selected_set.add(kb_name)
+                st.session_state.selected_kbs.append(kb_name)
+
+            # Track newly created KBs
+            newly_created_kbs.append(kb_name)
+
+            # Set as active KB if needed
+            if not st.session_state.active_kb or st.session_state.active_kb == "default_knowledge_base":
+                logger.info("Setting active knowledge base to: %s", kb_name)
+                st.session_state.active_kb = kb_name
+                set_active_knowledge_base(kb_name)
+
+            new_kb_created = True
+            success_count += 1
+
+            # Update the knowledge base list immediately
+            if kb_name not in known_set:
+                known_set.add(kb_name)
+                st.session_state.kb_names.append(kb_name)
 
-    # Process each file
-    for file, file_id in files_to_process:
-        try:
-            logger.info(f"Processing file: {file.name}")
+        else:
+            logger.error("Error processing %s: %s", file_name, result['message'])
+            error_count += 1
+            error_messages.append(f"❌ Error processing {file_name}: {result['message']}")
 
-            # Mark as processed
-            st.session_state.processed_files.add(file_id)
+    logger.info("Processing complete: %s successful, %s failed", success_count, error_count)
 
-            # Generate KB name from filename
-            file_name = file.name
-            base_name = os.path.splitext(file_name)[0].lower().replace(' ', '_')
-            kb_name = f"kb_{base_name}"
+    # Answers cached for these KBs were given without the new documents
+    if newly_created_kbs and st.session_state.semantic_cache_enabled:
+        invalidate_semantic_cache(session_semantic_cache(), newly_created_kbs)
 
-            # Ensure file is not corrupted by reading content
-            file_content = file.read()
-            file.seek(0)  # Reset file pointer after reading
+    # Update knowledge base list if new KBs were created
+    if new_kb_created:
+        get_all_knowledge_base_names_cached.clear()
+        get_compatible_knowledge_bases_cached.clear()
+        st.session_state.kb_names = get_all_knowledge_base_names_cached()
+
+    status_messages = []
+    if newly_created_kbs:
+        kb_list = ", ".join(newly_created_kbs)
+        status_messages.append(
+            f"✅ Created knowledge base(s): {kb_list} using {embedding_model.split('-')[0].title()} embedding + {chunking_strategy.replace('_', ' ').title()} chunking.")
+    status_messages.extend(error_messages)
+    if status_messages:
+        st.session_state.upload_status = {
+            "type": "success" if newly_created_kbs else "error",
+            "message": " ".join(status_messages)
+        }
 
-            logger.debug(f"File size: {len(file_content)} bytes")
-            logger.debug(f"Knowledge base name: {kb_name}")
+    # Turn off direct chat mode if we have successful uploads
+    if success_count > 0 and st.session_state.direct_chat_mode:
+        logger.info("Turning off direct chat mode due to successful KB creation")
+        st.session_state.direct_chat_mode = False
 
-            # Process the file with user-selected options
-            result = process_and_chunk_file(
-                file=file,
-                kb_name=kb_name,
-                embedding_model_name=embedding_model,  # Use user selection
-                chunking_strategy_name=chunking_strategy  # Use user selection
-            )
+    # Clear processing flag
+    st.session_state.processing_file = False
 
-            if result["status"] == "success":
-                logger.info(f"Successfully processed {file_name}: {result['chunk_count']} chunks")
 
-                # Add the new KB to the list of selected KBs
-                if kb_name not in st.session_state.selected_kbs:
-                    st.session_state.selected_kbs.append(kb_name)
+@st.fragment(run_every=2)
+def upload_progress():
+    """Poll the background upload and rerun the whole app once it has finished"""
+    job = st.session_state.get("upload_job")
+    if job is None:
+        return
+    if job["future"].done():
+        st.rerun()
+    st.status(f"Embedding {len(job['files'])} file(s)...", state="running")
 
-                # Track newly created KBs
-                newly_created_kbs.append(kb_name)
 
-                # Set as active KB if needed
-                if not st.session_state.active_kb or st.session_state.active_kb == "default_knowledge_base":
-                    logger.info(f"Setting active knowledge base to: {kb_name}")
-                    st.session_state.active_kb = kb_name
-                    set_active_knowledge_base(kb_name)
+@st.cache_resource
+def get_semantic_cache(threshold, max_size, ttl_hours):
+    # One store for the process; entries are scoped by conversation, knowledge bases and models
+    from utils.semantic_cache import SemanticCache
+    return SemanticCache(threshold=threshold, max_size=max_size, ttl_seconds=ttl_hours * 3600)
 
-                new_kb_created = True
-                success_count += 1
 
-                # Update the knowledge base list immediately
-                if kb_name not in st.session_state.kb_names:
-                    st.session_state.kb_names.append(kb_name)
+def session_semantic_cache():
+    cache_settings = st.session_state.settings.get("semantic_cache", {})
+    return get_semantic_cache(cache_settings.get("threshold", 0.95),
+                              cache_settings.get("max_size", 2000),
+                              cache_settings.get("ttl_hours", 168))
 
-                st.session_state.upload_status = {
-                    "type": "success",
-                    "message": f"✅ {file_name} processed with {result['chunk_count']} chunks using {embedding_model.split('-')[0].title()} + {chunking_strategy.replace('_', ' ').title()}"
-                }
-            else:
-                logger.error(f"Error processing {file_name}: {result['message']}")
-                error_count += 1
-                st.session_state.upload_status = {
-                    "type": "error",
-                    "message": f"❌ Error processing {file_name}: {result['message']}"
-                }
-        except Exception as e:
-            logger.exception(f"Exception while processing {file.name}: {str(e)}")
-            error_count += 1
-            st.session_state.upload_status = {
-                "type": "error",
-                "message": f"❌ Error: {str(e)}"
-            }
 
-    logger.info(f"Processing complete: {success_count} successful, {error_count} failed")
+@st.fragment(run_every=1)
+def query_progress(show=True):
+    """Poll the background RAG query and rerun the whole app once it has finished"""
+    pending = st.session_state.pending_query
+    if pending is None or pending[1].done():
+        st.rerun()
+    if show:
+        with st.chat_message("assistant"):
+            st.status("Thinking...", state="running")
 
-    # Update knowledge base list if new KBs were created
-    if new_kb_created:
-        st.session_state.kb_names = get_all_knowledge_base_names()
 
-        # Add a new status message about knowledge bases
-        if newly_created_kbs:
-            kb_list = ", ".join(newly_created_kbs)
-            st.session_state.upload_status = {
-                "type": "success",
-                "message": f"✅ Created knowledge base(s): {kb_list} using {embedding_model.split('-')[0].title()} embedding + {chunking_strategy.replace('_', ' ').title()} chunking."
-            }
+# Toggling older conversations reruns only this panel; switching or deleting a
+# conversation changes the chat area too, so those still rerun the whole app
+@st.fragment
+def history_panel(current_user):
+    # Only build buttons for the most recent conversations unless older ones are requested
+    conversations = st.session_state.conversations
+    older_count = len(conversations) - RECENT_CONVERSATION_LIMIT
+    if older_count > 0 and not st.session_state.get("show_older_conversations", False):
+        conversations = conversations[:RECENT_CONVERSATION_LIMIT]
 
-    # Turn off direct chat mode if we have successful uploads
-    if success_count > 0 and st.session_state.direct_chat_mode:
-        logger.info("Turning off direct chat mode due to successful KB creation")
+    for conv_id, title, *_ in conversations:
+        col1, col2 = st.columns([5, 1])
+
+        with col1:
+            is_active = conv_id == st.session_state.current_conversation_id
+            button_type = "primary" if is_active else "secondary"
+            display_title = f"📝 {title}" if is_active else title
+
+            if st.button(
+                    display_title,
+                    key=f"conv_{conv_id}",
+                    use_container_width=True,
+                    type=button_type
+            ):
+                logger.info("Switching to conversation: %s", conv_id)
+                st.session_state.current_conversation_id = conv_id
+                load_recent_messages(conv_id)
+                st.rerun()
+
+        with col2:
+            if st.button("🗑️", key=f"delete_{conv_id}", help="Delete this conversation"):
+                logger.info("Deleting conversation: %s", conv_id)
+                delete_conversation(conv_id)
+                refresh_conversations(current_user)
+
+                if st.session_state.conversations:
+                    if conv_id == st.session_state.current_conversation_id:
+                        st.session_state.current_conversation_id = st.session_state.conversations[0][0]
+                        load_recent_messages(st.session_state.current_conversation_id)
+                else:
+                    new_id = create_conversation(created_by=current_user)
+                    st.session_state.current_conversation_id = new_id
+                    refresh_conversations(current_user)
+                    st.session_state.messages = []
+
+                st.rerun()
+
+    if older_count > 0:
+        st.checkbox(f"Show older conversations ({older_count})", key="show_older_conversations")
+
+
+def _activate_radio_kb():
+    kb_name = st.session_state.active_kb_radio
+    if kb_name is None or kb_name == st.session_state.active_kb:
+        return
+    st.session_state.active_kb = kb_name
+    set_active_knowledge_base(kb_name)
+    st.session_state.direct_chat_mode = False
+    save_kb_query_params()
+
+
+def _remove_kb_from_selection(kb_name):
+    if kb_name not in st.session_state.selected_kbs:
+        return
+    st.session_state.selected_kbs = [kb for kb in st.session_state.selected_kbs if kb != kb_name]
+    if kb_name == st.session_state.active_kb and st.session_state.selected_kbs:
+        st.session_state.active_kb = st.session_state.selected_kbs[0]
+        set_active_knowledge_base(st.session_state.selected_kbs[0])
+    elif not st.session_state.selected_kbs:
+        st.session_state.direct_chat_mode = True
+    save_kb_query_params()
+
+
+def _sidebar_kb_selection_changed():
+    _set_sidebar_kb_selection(st.session_state.kb_multiselect)
+
+
+def _set_sidebar_kb_selection(selected_kbs):
+    if selected_kbs == st.session_state.selected_kbs:
+        return
+    st.session_state.selected_kbs = selected_kbs
+
+    # If there are selected KBs, set the first one as active
+    if selected_kbs:
+        if st.session_state.active_kb != selected_kbs[0]:
+            st.session_state.active_kb = selected_kbs[0]
+            set_active_knowledge_base(selected_kbs[0])
         st.session_state.direct_chat_mode = False
+    else:
+        # If no KBs selected, switch to direct chat mode
+        st.session_state.direct_chat_mode = True
 
-    # Clear processing flag
-    st.session_state.processing_file = False
+    save_kb_query_params()
 
 
 def sidebar():
@@ -337,25 +716,22 @@ def sidebar():
     current_user = st.session_state.get('username', 'admin')
     user_display_name = st.session_state.get('name', current_user)
 
-    # Check if user changed and refresh conversations if needed
+    # Check if user changed; init_session_state has already loaded this user's conversations
     if "last_user" not in st.session_state:
         st.session_state.last_user = current_user
-        st.session_state.conversations = get_conversations(current_user)
     elif st.session_state.last_user != current_user:
-        # User changed, refresh conversations
-        logger.info(f"User changed from {st.session_state.last_user} to {current_user}, refreshing conversations")
+        logger.info("User changed from %s to %s, refreshing conversations", st.session_state.last_user, current_user)
         st.session_state.last_user = current_user
-        st.session_state.conversations = get_conversations(current_user)
 
         # Reset current conversation if user has conversations
         if st.session_state.conversations:
             st.session_state.current_conversation_id = st.session_state.conversations[0][0]
-            st.session_state.messages = get_messages(st.session_state.current_conversation_id)
+            load_recent_messages(st.session_state.current_conversation_id)
         else:
             # Create new conversation for the new user
             new_id = create_conversation(created_by=current_user)
             st.session_state.current_conversation_id = new_id
-            st.session_state.conversations = get_conversations(current_user)
+            refresh_conversations(current_user)
             st.session_state.messages = []
 
         st.rerun()  # Only rerun when user actually changes
@@ -367,10 +743,10 @@ def sidebar():
 
     # New Chat Button with better styling
     if st.sidebar.button("✨ New Chat", use_container_width=True, help="Start a new conversation"):
-        logger.info(f"Creating new chat for user: {current_user}")
+        logger.info("Creating new chat for user: %s", current_user)
         new_id = create_conversation(created_by=current_user)
         st.session_state.current_conversation_id = new_id
-        st.session_state.conversations = get_conversations(current_user)
+        refresh_conversations(current_user)
         st.session_state.messages = []
         st.rerun()
 
@@ -385,18 +761,18 @@ def sidebar():
         help="Chat directly with the AI without using a knowledge base"
     )
     if direct_chat != st.session_state.direct_chat_mode:
-        logger.info(f"Changing direct chat mode to: {direct_chat}")
+        logger.info("Changing direct chat mode to: %s", direct_chat)
         st.session_state.direct_chat_mode = direct_chat
         new_id = create_conversation(created_by=current_user)
         st.session_state.current_conversation_id = new_id
-        st.session_state.conversations = get_conversations(current_user)
+        refresh_conversations(current_user)
         st.session_state.messages = []
         st.rerun()
 
     st.sidebar.markdown("### 🤖 Chat Model Selection")
 
     # Get current LLM from session state or default
-    model_options = ["__select__"] + [model.value for model in ChatModel]
+    model_options, model_index = get_chat_model_options()
 
     # Use "__select__" as default if not previously selected
     current_llm = st.session_state.get("selected_chat_model", "__select__")
@@ -412,14 +788,14 @@ def sidebar():
             "llama3.2:latest": "🦙 Llama 3.2 (Local)",
             "gemma2:2b": "🌪️ Gemma (Local)"
         }.get(x, x),
-        index=model_options.index(current_llm) if current_llm in model_options else 0,
+        index=model_index.get(current_llm, 0),
         help="Select the AI model for conversations"
     )
 
     # Update session state if selection changed
     if selected_llm != st.session_state.get('selected_chat_model'):
         st.session_state.selected_chat_model = selected_llm
-        logger.info(f"Updated selected_chat_model to: {selected_llm}")
+        logger.info("Updated selected_chat_model to: %s", selected_llm)
         # Save user preference
         current_user = st.session_state.get('username', 'admin')
         set_setting(f"user_{current_user}_chat_model", selected_llm)
@@ -457,20 +833,11 @@ def sidebar():
 
     # Determine compatible embedding model
     chat_model = st.session_state.get('selected_chat_model')
-    logger.info(f"Current chat model in sidebar: {chat_model}")
+    logger.info("Current chat model in sidebar: %s", chat_model)
 
-    if chat_model.startswith("gpt"):
-        compatible_embedding = "text-embedding-3-small"
-    elif chat_model.startswith("llama"):
-        compatible_embedding = "llama3.2:latest"
-    elif chat_model.startswith("deepseek"):
-        compatible_embedding = "deepseek-r1:latest"
-    elif chat_model.startswith("gemma"):
-        compatible_embedding = "gemma2:2b"
-    else:
-        compatible_embedding = "text-embedding-3-small"
+    compatible_embedding = get_compatible_embedding_model(chat_model)
 
-    logger.info(f"Determined compatible embedding: {compatible_embedding}")
+    logger.info("Determined compatible embedding: %s", compatible_embedding)
 
     # Show current model info
     if chat_model.startswith("gpt"):
@@ -494,22 +861,25 @@ def sidebar():
         """, unsafe_allow_html=True)
 
     # Get compatible knowledge bases
-    compatible_kbs = get_compatible_knowledge_bases(compatible_embedding)
+    compatible_kbs = get_compatible_knowledge_bases_cached(compatible_embedding)
     st.session_state.kb_names = compatible_kbs
+    # Position of each KB in kb_names, for O(1) membership and widget index lookups
+    st.session_state.kb_index = {name: i for i, name in enumerate(compatible_kbs)}
+    compatible_set = st.session_state.kb_index
 
     # Filter selected KBs to only include compatible ones
     if "selected_kbs" in st.session_state:
         old_selected = st.session_state.selected_kbs.copy()
-        st.session_state.selected_kbs = [kb for kb in st.session_state.selected_kbs if kb in compatible_kbs]
+        st.session_state.selected_kbs = [kb for kb in st.session_state.selected_kbs if kb in compatible_set]
 
         if old_selected != st.session_state.selected_kbs:
-            logger.info(f"Filtered KBs from {old_selected} to {st.session_state.selected_kbs}")
+            logger.info("Filtered KBs from %s to %s", old_selected, st.session_state.selected_kbs)
 
     # Update active KB if it's not compatible
-    if st.session_state.get('active_kb') and st.session_state.active_kb not in compatible_kbs:
+    if st.session_state.get('active_kb') and st.session_state.active_kb not in compatible_set:
         if compatible_kbs:
             st.session_state.active_kb = compatible_kbs[0]
-            logger.info(f"Updated active KB to: {compatible_kbs[0]}")
+            logger.info("Updated active KB to: %s", compatible_kbs[0])
         # else:
         #     st.session_state.active_kb = None
         #     st.session_state.direct_chat_mode = True
@@ -517,75 +887,51 @@ def sidebar():
 
     # Knowledge base selection UI
     if compatible_kbs:
-        # Create a multiselect for knowledge bases
-        default_selections = st.session_state.selected_kbs if "selected_kbs" in st.session_state else [
-            st.session_state.active_kb] if st.session_state.active_kb else []
-
-        # Select all/none buttons
+        # Select all/none buttons. As callbacks they run before the script, so the direct chat checkbox
+        # above and the multiselect below both see the new selection without an extra rerun
         col1, col2 = st.sidebar.columns([1, 1])
 
         with col1:
-            if st.button("Select All", key="select_all_kbs", use_container_width=True, type="primary"):
-                st.session_state.selected_kbs = compatible_kbs.copy()
-                st.rerun()
+            st.button("Select All", key="select_all_kbs", use_container_width=True, type="primary",
+                      on_click=_set_sidebar_kb_selection, args=(compatible_kbs.copy(),))
 
         with col2:
-            if st.button("Clear All", key="clear_all_kbs", use_container_width=True):
-                st.session_state.selected_kbs = []
-                st.rerun()
+            st.button("Clear All", key="clear_all_kbs", use_container_width=True,
+                      on_click=_set_sidebar_kb_selection, args=([],))
 
-        # Display the multiselect
-        selected_kbs = st.sidebar.multiselect(
+        # The multiselect is seeded from selected_kbs rather than given a default, since callbacks and
+        # the main-area selector also change the selection; its own edits arrive through on_change
+        st.session_state.kb_multiselect = list(st.session_state.selected_kbs)
+        st.sidebar.multiselect(
             "Select knowledge bases to use",
             options=compatible_kbs,
-            default=default_selections,
             key="kb_multiselect",
+            on_change=_sidebar_kb_selection_changed,
             label_visibility="collapsed"
         )
 
-        # Update the selected KBs in session state
-        if selected_kbs != st.session_state.selected_kbs:
-            st.session_state.selected_kbs = selected_kbs
-
-            # If there are selected KBs, set the first one as active
-            if selected_kbs:
-                st.session_state.active_kb = selected_kbs[0]
-                set_active_knowledge_base(selected_kbs[0])
-                st.session_state.direct_chat_mode = False
-            else:
-                # If no KBs selected, switch to direct chat mode
-                st.session_state.direct_chat_mode = True
-
-            st.rerun()
-
-        # Display individual KB options
+        # Pick the active KB with one radio instead of a column pair of buttons per KB. The choice is
+        # only persisted from on_change, so a rerun that finds no active KB in the list writes nothing
         if st.session_state.selected_kbs:
             st.sidebar.markdown("### Active Knowledge Bases")
-            for i, kb_name in enumerate(st.session_state.selected_kbs):
-                kb_active = kb_name == st.session_state.active_kb
-
-                col1, col2 = st.sidebar.columns([4, 1])
-
-                with col1:
-                    button_label = f"{'📌' if kb_active else '📄'} {kb_name}"
-                    if st.button(button_label, key=f"sidebar_activate_{kb_name}_{i}",
-                                 use_container_width=True,
-                                 type="primary" if kb_active else "secondary"):
-                        st.session_state.active_kb = kb_name
-                        set_active_knowledge_base(kb_name)
-                        st.session_state.direct_chat_mode = False
-                        st.rerun()
-
-                with col2:
-                    if st.button("❌", key=f"sidebar_remove_{kb_name}_{i}",
-                                 help=f"Remove {kb_name} from selection"):
-                        st.session_state.selected_kbs.remove(kb_name)
-                        if kb_name == st.session_state.active_kb and st.session_state.selected_kbs:
-                            st.session_state.active_kb = st.session_state.selected_kbs[0]
-                            set_active_knowledge_base(st.session_state.selected_kbs[0])
-                        elif not st.session_state.selected_kbs:
-                            st.session_state.direct_chat_mode = True
-                        st.rerun()
+            selected = st.session_state.selected_kbs
+            active_kb = st.sidebar.radio(
+                "Active knowledge base",
+                options=selected,
+                index=selected.index(st.session_state.active_kb) if st.session_state.active_kb in selected else None,
+                format_func=lambda kb: f"{'📌' if kb == st.session_state.active_kb else '📄'} {kb}",
+                key="active_kb_radio",
+                on_change=_activate_radio_kb,
+                label_visibility="collapsed"
+            )
+            st.sidebar.button(
+                f"❌ Remove {active_kb} from selection" if active_kb else "❌ Remove from selection",
+                key="remove_active_kb",
+                disabled=active_kb is None,
+                use_container_width=True,
+                on_click=_remove_kb_from_selection,
+                args=(active_kb,)
+            )
     else:
         st.sidebar.info("No knowledge bases found. Upload documents to create one.")
 
@@ -606,77 +952,222 @@ def sidebar():
     </div>
     """, unsafe_allow_html=True)
 
-    for conv_id, title, created_at in st.session_state.conversations:
-        col1, col2 = st.sidebar.columns([5, 1])
+    # Rendered inside the sidebar so the fragment's elements land there
+    with st.sidebar:
+        history_panel(current_user)
 
-        with col1:
-            is_active = conv_id == st.session_state.current_conversation_id
-            button_type = "primary" if is_active else "secondary"
-            display_title = f"📝 {title}" if is_active else title
+    # LLM Selection Section
 
-            if st.button(
-                    display_title,
-                    key=f"conv_{conv_id}",
-                    use_container_width=True,
-                    type=button_type
-            ):
-                logger.info(f"Switching to conversation: {conv_id}")
-                st.session_state.current_conversation_id = conv_id
-                st.session_state.messages = get_messages(conv_id)
-                st.rerun()
 
-        with col2:
-            if st.button("🗑️", key=f"delete_{conv_id}", help="Delete this conversation"):
-                logger.info(f"Deleting conversation: {conv_id}")
-                delete_conversation(conv_id)
-                st.session_state.conversations = get_conversations(current_user)
 
-                if st.session_state.conversations:
-                    if conv_id == st.session_state.current_conversation_id:
-                        st.session_state.current_conversation_id = st.session_state.conversations[0][0]
-                        st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-                else:
-                    new_id = create_conversation(created_by=current_user)
-                    st.session_state.current_conversation_id = new_id
-                    st.session_state.conversations = get_conversations(current_user)
-                    st.session_state.messages = []
 
-                st.rerun()
 
-    # LLM Selection Section
+def save_kb_query_params():
+    """Mirror the KB selection into the URL so a reload or shared link restores it"""
+    # A repeated ?kbs= parameter per KB, so names containing commas survive the round trip
+    if st.session_state.selected_kbs:
+        st.query_params["kbs"] = list(st.session_state.selected_kbs)
+    else:
+        st.query_params.pop("kbs", None)
+    if st.session_state.active_kb:
+        st.query_params["active"] = st.session_state.active_kb
+    else:
+        st.query_params.pop("active", None)
+
+
+def _kb_state():
+    return st.session_state.direct_chat_mode, tuple(st.session_state.selected_kbs), st.session_state.active_kb
+
+
+# Button callbacks run before the rerun a click triggers, so the whole page renders with the new state.
+# Each records whether it changed anything; if not, the submit only reruns the kb_selector fragment
+def _activate_selected_kb():
+    before = _kb_state()
+    selected_kb = st.session_state.kb_dropdown
+    st.session_state.direct_chat_mode = False
+    if selected_kb not in st.session_state.selected_kbs:
+        st.session_state.selected_kbs.append(selected_kb)
+    # Re-activating the current KB would only rewrite the same setting
+    if st.session_state.active_kb != selected_kb:
+        st.session_state.active_kb = selected_kb
+        set_active_knowledge_base(selected_kb)
+    st.session_state.kb_state_changed = _kb_state() != before
+    save_kb_query_params()
+
+
+def _save_kb_selection():
+    before = _kb_state()
+    multi_select = st.session_state.kb_multiselect_main
+    st.session_state.selected_kbs = multi_select
+    if not multi_select:
+        st.session_state.direct_chat_mode = True
+    elif st.session_state.active_kb not in multi_select and multi_select:
+        st.session_state.active_kb = multi_select[0]
+        set_active_knowledge_base(multi_select[0])
+    st.session_state.kb_state_changed = _kb_state() != before
+    save_kb_query_params()
+
+
+def _select_all_kbs():
+    before = _kb_state()
+    st.session_state.selected_kbs = st.session_state.kb_names.copy()
+    if not st.session_state.active_kb and st.session_state.selected_kbs:
+        st.session_state.active_kb = st.session_state.selected_kbs[0]
+        set_active_knowledge_base(st.session_state.selected_kbs[0])
+    st.session_state.direct_chat_mode = False
+    st.session_state.kb_state_changed = _kb_state() != before
+    save_kb_query_params()
+
+
+def post_user_message(content):
+    """Save a user turn and start thinking; the first turn of a conversation also becomes its title"""
+    user_name = st.session_state.get('name', 'Anonymous')  # Use 'name' not 'username'
+    logger.info("Adding message from user: %s", user_name)
+    # One transaction writes the message and title and reads back the refreshed lists
+    messages, conversations = add_message_and_maybe_retitle(
+        st.session_state.current_conversation_id,
+        "user",  # Keep for LangChain compatibility
+        content,
+        user_name,
+        list_user=st.session_state.get('username', 'admin'),
+        message_limit=MESSAGE_PAGE_SIZE
+    )
+    get_recent_messages_cached.clear()
+    get_conversations_cached.clear()
+    st.session_state.messages = with_display_times(messages)
+    st.session_state.has_earlier_messages = len(messages) == MESSAGE_PAGE_SIZE
+    st.session_state.conversations = conversations
+    st.session_state.is_thinking = True
 
 
+def _ask_suggestion(suggestion):
+    post_user_message(suggestion)
 
 
+# The widgets sit in a form, so editing them costs no rerun at all; a submit button applies the
+# edit in its callback, and reruns the whole app only when the KB state actually changed
+@st.fragment
+def kb_selector():
+    with st.expander("📚 Select Knowledge Base", expanded=True):
+        st.write("### Available Knowledge Bases")
+        st.write("Select and activate knowledge bases for your questions:")
 
-def chat_interface():
-    # Get current chat model
-    current_chat_model = st.session_state.get('selected_chat_model', ChatModel.GPT_4O_MINI.value)
+        with st.form("kb_selection", border=False):
+            # Use a dropdown for selecting the active KB
+            st.selectbox(
+                "Set Active Knowledge Base:",
+                options=st.session_state.kb_names,
+                index=st.session_state.kb_index.get(st.session_state.active_kb, 0),
+                key="kb_dropdown"
+            )
+
+            if st.form_submit_button("🎯 Activate Selected KB", on_click=_activate_selected_kb) \
+                    and st.session_state.kb_state_changed:
+                st.rerun()
+
+            # Multi-select for choosing which KBs to use
+            st.multiselect(
+                "Select Knowledge Bases to Use:",
+                options=st.session_state.kb_names,
+                default=st.session_state.selected_kbs,
+                key="kb_multiselect_main"
+            )
+
+            col1, col2 = st.columns(2)
 
-    # Mode indicator with model info
-    if st.session_state.direct_chat_mode:
-        mode_text = f"Direct Chat: {current_chat_model.replace('gpt-', 'GPT-').replace(':', ' ').title()}"
-        mode_class = "openai" if current_chat_model.startswith("gpt") else "ollama"
+            with col1:
+                if st.form_submit_button("💾 Save Selection", on_click=_save_kb_selection) \
+                        and st.session_state.kb_state_changed:
+                    st.rerun()
+
+            with col2:
+                if st.form_submit_button("🔄 Select All KBs", on_click=_select_all_kbs) \
+                        and st.session_state.kb_state_changed:
+                    st.rerun()
+
+
+# Only the message list reruns when older messages are loaded
+@st.fragment
+def render_messages():
+    # Older messages are only fetched when asked for
+    if st.session_state.get("has_earlier_messages") and st.session_state.messages:
+        if st.button("⬆️ Load earlier messages", key="load_earlier_messages"):
+            earlier = get_messages(st.session_state.current_conversation_id, limit=MESSAGE_PAGE_SIZE,
+                                   before_id=st.session_state.messages[0][0], include_system=False)
+            st.session_state.messages = with_display_times(earlier) + st.session_state.messages
+            st.session_state.has_earlier_messages = len(earlier) == MESSAGE_PAGE_SIZE
+            st.rerun(scope="fragment")
+
+    # Display existing messages
+    for msg_id, role, content, user_name, _timestamp, formatted_time in st.session_state.messages:
+
+        with st.chat_message(role):
+            if user_name and user_name != role:
+                st.markdown(f"**{user_name}:**")
+            st.write(content)
+            st.markdown(
+                f"<div style='font-size:11px; color:#6b7280; text-align:right; margin-top:5px;'>{formatted_time}</div>",
+                unsafe_allow_html=True)
+
+            # Show sources for assistant messages (only in RAG mode) - improved styling
+            # In chat_interface() function where it displays sources:
+
+            # Show sources for assistant messages (only in RAG mode) - improved styling with tabs
+            if role == "assistant" and st.session_state.show_sources and not st.session_state.direct_chat_mode:
+                source_cards = render_source_cards(msg_id)
+                if source_cards:
+                    relevant_html, kb_html = source_cards
+                    with st.expander("📄 Sources", expanded=False):
+                        # Create tabs for different source views
+                        source_tabs = st.tabs(["📚 Query-Relevant Sources", "🗂️ Selected Knowledge Bases"])
+
+                        # First tab: Query-relevant sources (sorted by relevance)
+                        with source_tabs[0]:
+                            st.markdown(relevant_html, unsafe_allow_html=True)
+
+                        # Second tab: Group by knowledge base
+                        with source_tabs[1]:
+                            st.markdown(kb_html, unsafe_allow_html=True)
+
+
+def build_mode_banner(direct_chat_mode, selected_kbs, active_kb, chat_model):
+    """Mode indicator HTML, plus the KB list when several are selected"""
+    model_label = chat_model.replace('gpt-', 'GPT-').replace(':', ' ').title()
+    if direct_chat_mode:
+        mode_text = f"Direct Chat: {model_label}"
+        mode_class = "openai" if chat_model.startswith("gpt") else "ollama"
     else:
-        if len(st.session_state.selected_kbs) > 1:
-            mode_text = f"Multiple KBs + {current_chat_model.replace('gpt-', 'GPT-').replace(':', ' ').title()}"
+        if len(selected_kbs) > 1:
+            mode_text = f"Multiple KBs + {model_label}"
         else:
-            mode_text = f"KB: {st.session_state.active_kb} + {current_chat_model.replace('gpt-', 'GPT-').replace(':', ' ').title()}"
+            mode_text = f"KB: {active_kb} + {model_label}"
         mode_class = "rag"
 
-    st.markdown(f"""
+    html = f"""
     <div class='toggle-container' style='margin-bottom:20px;'>
         <h3 style='margin:0;'>{mode_text}</h3>
         <span class='mode-indicator {mode_class}' style='font-weight:600;'>{mode_class.upper()}</span>
     </div>
-    """, unsafe_allow_html=True)
+    """
 
     # If multiple KBs are selected, show them
-    if not st.session_state.direct_chat_mode and len(st.session_state.selected_kbs) > 1:
-        kb_list = ", ".join([f"'{kb}'" for kb in st.session_state.selected_kbs])
-        st.markdown(
-            f"<p style='font-size:14px; color:#6b7280; margin-bottom:20px;'>Using knowledge bases: {kb_list}</p>",
-            unsafe_allow_html=True)
+    if not direct_chat_mode and len(selected_kbs) > 1:
+        kb_list = ", ".join([f"'{kb}'" for kb in selected_kbs])
+        html += f"<p style='font-size:14px; color:#6b7280; margin-bottom:20px;'>Using knowledge bases: {kb_list}</p>"
+    return html
+
+
+def chat_interface():
+    # Get current chat model
+    current_chat_model = st.session_state.get('selected_chat_model', ChatModel.GPT_4O_MINI.value)
+
+    # Mode indicator with model info; rebuilt only when the mode, KBs or model change
+    banner_sig = (st.session_state.direct_chat_mode, tuple(st.session_state.selected_kbs),
+                  st.session_state.active_kb, current_chat_model)
+    if st.session_state.get("mode_banner_sig") != banner_sig:
+        st.session_state.mode_banner_sig = banner_sig
+        st.session_state.mode_banner_html = build_mode_banner(*banner_sig)
+    st.markdown(st.session_state.mode_banner_html, unsafe_allow_html=True)
 
     # Option to show sources (only in RAG mode) - better styling
     if not st.session_state.direct_chat_mode:
@@ -709,7 +1200,8 @@ def chat_interface():
                 st.warning("⚠️ Please select an embedding model to proceed.")
             else:
                 if embedding_choice == EmbeddingModel.OPEN_AI.value:
-                    chunking_choice = "semantic_percentile"
+                    # Semantic chunking embeds every sentence just to find split points, so it is opt-in
+                    chunking_choice = st.session_state.settings.get("openai_chunking_strategy", "recursive")
                     # st.info(f"📌 Chunking strategy: `{chunking_choice}`")
                     st.write(f"Selected Chunking Strategy: `{chunking_choice}`")
                 else:
@@ -750,60 +1242,12 @@ def chat_interface():
 
                 # Auto-process files when uploaded
                 if uploaded_files and not st.session_state.processing_file:
-                    with st.spinner("Processing files..."):
-                        process_uploaded_files(uploaded_files, embedding_choice, chunking_choice)
+                    process_uploaded_files(uploaded_files, embedding_choice, chunking_choice)
+                upload_progress()
 
     # Knowledge Base Selector (only show in RAG mode)
     if not st.session_state.direct_chat_mode and st.session_state.kb_names and len(st.session_state.kb_names) > 0:
-        with st.expander("📚 Select Knowledge Base", expanded=True):
-            st.write("### Available Knowledge Bases")
-            st.write("Select and activate knowledge bases for your questions:")
-
-            # Use a dropdown for selecting the active KB
-            selected_kb = st.selectbox(
-                "Set Active Knowledge Base:",
-                options=st.session_state.kb_names,
-                index=st.session_state.kb_names.index(
-                    st.session_state.active_kb) if st.session_state.active_kb in st.session_state.kb_names else 0,
-                key="kb_dropdown"
-            )
-
-            if st.button("🎯 Activate Selected KB", key="activate_from_dropdown"):
-                st.session_state.active_kb = selected_kb
-                st.session_state.direct_chat_mode = False
-                if selected_kb not in st.session_state.selected_kbs:
-                    st.session_state.selected_kbs.append(selected_kb)
-                set_active_knowledge_base(selected_kb)
-                st.rerun()
-
-            # Multi-select for choosing which KBs to use
-            multi_select = st.multiselect(
-                "Select Knowledge Bases to Use:",
-                options=st.session_state.kb_names,
-                default=st.session_state.selected_kbs,
-                key="kb_multiselect_main"
-            )
-
-            col1, col2 = st.columns(2)
-
-            with col1:
-                if st.button("💾 Save Selection", key="save_kb_selection"):
-                    st.session_state.selected_kbs = multi_select
-                    if not multi_select:
-                        st.session_state.direct_chat_mode = True
-                    elif st.session_state.active_kb not in multi_select and multi_select:
-                        st.session_state.active_kb = multi_select[0]
-                        set_active_knowledge_base(multi_select[0])
-                    st.rerun()
-
-            with col2:
-                if st.button("🔄 Select All KBs", key="select_all_kbs_main"):
-                    st.session_state.selected_kbs = st.session_state.kb_names.copy()
-                    if not st.session_state.active_kb and st.session_state.selected_kbs:
-                        st.session_state.active_kb = st.session_state.selected_kbs[0]
-                        set_active_knowledge_base(st.session_state.selected_kbs[0])
-                    st.session_state.direct_chat_mode = False
-                    st.rerun()
+        kb_selector()
 
     # Suggested prompts (only show when no messages yet AND not in direct mode)
     if not st.session_state.messages and not st.session_state.direct_chat_mode:
@@ -812,291 +1256,135 @@ def chat_interface():
 
         # Show suggestions in columns
         col1, col2 = st.columns(2)
-        suggestions = get_suggested_prompts()
-        user_name = st.session_state.get('name', 'Anonymous')
-        with col1:
-            for i in range(0, len(suggestions), 2):
-                if i < len(suggestions):
-                    if st.button(f"💡 {suggestions[i]}", key=f"sugg_{i}", use_container_width=True):
-                        user_name = st.session_state.get('name', 'Anonymous')
-                        message_id = add_message(st.session_state.current_conversation_id, "user", suggestions[i],
-                                                 user_name)
-                        st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-                        title = suggestions[i][:30] + ('...' if len(suggestions[i]) > 30 else '')
-                        update_conversation_title(st.session_state.current_conversation_id, title)
-                        st.session_state.is_thinking = True
-                        st.rerun()
+        left, right = get_suggestion_columns()
+        for column, buttons in ((col1, left), (col2, right)):
+            with column:
+                for label, key, suggestion in buttons:
+                    st.button(label, key=key, use_container_width=True,
+                              disabled=st.session_state.pending_query is not None,
+                              on_click=_ask_suggestion, args=(suggestion,))
 
-        with col2:
-            for i in range(1, len(suggestions), 2):
-                if i < len(suggestions):
-                    if st.button(f"💡 {suggestions[i]}", key=f"sugg_{i}", use_container_width=True):
-                        message_id = add_message(st.session_state.current_conversation_id, "user", suggestions[i],
-                                                 user_name)
-                        st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-                        title = suggestions[i][:30] + ('...' if len(suggestions[i]) > 30 else '')
-                        update_conversation_title(st.session_state.current_conversation_id, title)
-                        st.session_state.conversations = get_conversations()
-                        logger.info(f"Updated conversation title to: {title}")
-                        st.session_state.is_thinking = True
-                        st.rerun()
-
-        # Chat messages - with improved styling
-    message_container = st.container()
-
-    with message_container:
-        # Display existing messages
-        for msg_id, role, content, user_name, timestamp in st.session_state.messages:
-            if role == "system":
-                continue  # Skip system messages
-            formatted_time = timestamp.strftime("%H:%M")
-
-            with st.chat_message(role):
-                if user_name and user_name != role:
-                    st.markdown(f"**{user_name}:**")
-                st.write(content)
-                st.markdown(
-                    f"<div style='font-size:11px; color:#6b7280; text-align:right; margin-top:5px;'>{formatted_time}</div>",
-                    unsafe_allow_html=True)
-
-                # Show sources for assistant messages (only in RAG mode) - improved styling
-                # In chat_interface() function where it displays sources:
-
-                # Show sources for assistant messages (only in RAG mode) - improved styling with tabs
-                if role == "assistant" and st.session_state.show_sources and not st.session_state.direct_chat_mode:
-                    sources = get_sources(msg_id)
-                    if sources:
-                        with st.expander("📄 Sources", expanded=False):
-                            # Create tabs for different source views
-                            source_tabs = st.tabs(["📚 Query-Relevant Sources", "🗂️ Selected Knowledge Bases"])
-
-                            # First tab: Query-relevant sources (sorted by relevance)
-                            with source_tabs[0]:
-                                # Group sources by unique document/page to avoid duplicates
-                                unique_sources = {}
-                                for source in sources:
-                                    key = (source.get('source', 'Unknown'), source.get('page', 0))
-                                    # Only keep the source with the highest score
-                                    if key not in unique_sources or source.get('score', 0) > unique_sources[
-                                        key].get('score', 0):
-                                        unique_sources[key] = source
-
-                                # Sort by relevance score
-                                sorted_sources = sorted(unique_sources.values(), key=lambda x: x.get('score', 0),
-                                                        reverse=True)
-
-                                for i, source in enumerate(sorted_sources):
-                                    source_name = source.get('source', 'Unknown')
-                                    page_number = source.get('page', 0)
-                                    score = source.get('score', 0)
-                                    kb_name = source.get('kb_name', 'Unknown KB')
-                                    score_percentage = int(score * 100)
-
-                                    # Better source display with color-coded relevance
-                                    relevance_color = "#10b981"  # Green for high relevance
-                                    if score_percentage < 70:
-                                        relevance_color = "#f59e0b"  # Yellow for medium relevance
-                                    if score_percentage < 50:
-                                        relevance_color = "#ef4444"  # Red for low relevance
-
-                                    st.markdown(f"""
-                                    <div style='margin-bottom:12px; padding:10px; border-radius:6px; background-color:#f9fafb; border-left:4px solid {relevance_color};'>
-                                        <div style='font-weight:600; font-size:15px;'>{i + 1}. {source_name}</div>
-                                        <div style='display:flex; flex-wrap:wrap; justify-content:space-between; margin-top:5px;'>
-                                            <span style='font-weight:500; margin-right:8px;'>KB: {kb_name}</span>
-                                            <span style='background:#5b2d91; color:white; padding:2px 8px; border-radius:12px; font-size:12px; margin-right:8px;'>Page {page_number}</span>
-                                            <span style='color:{relevance_color}; font-weight:500;'>Relevance: {score_percentage}%</span>
-                                        </div>
-                                    </div>
-                                    """, unsafe_allow_html=True)
-
-                            # Second tab: Group by knowledge base
-                            with source_tabs[1]:
-                                # Group sources by knowledge base
-                                kb_groups = {}
-                                for source in sources:
-                                    kb_name = source.get('kb_name', 'Unknown KB')
-                                    if kb_name not in kb_groups:
-                                        kb_groups[kb_name] = []
-                                    kb_groups[kb_name].append(source)
-
-                                # Sort knowledge bases alphabetically for consistent display
-                                for kb_name in sorted(kb_groups.keys()):
-                                    kb_sources = kb_groups[kb_name]
-
-                                    # Deduplicate sources within this KB
-                                    unique_kb_sources = {}
-                                    for source in kb_sources:
-                                        key = (source.get('source', 'Unknown'), source.get('page', 0))
-                                        if key not in unique_kb_sources or source.get('score', 0) > \
-                                                unique_kb_sources[key].get('score', 0):
-                                            unique_kb_sources[key] = source
-
-                                    # Sort by source name and page
-                                    sorted_kb_sources = sorted(unique_kb_sources.values(),
-                                                               key=lambda x: (x.get('source', 'Unknown'),
-                                                                              x.get('page', 0)))
-
-                                    # Only display KB section if it has sources
-                                    if sorted_kb_sources:
-                                        st.markdown(f"### {kb_name}")
-
-                                        for i, source in enumerate(sorted_kb_sources):
-                                            source_name = source.get('source', 'Unknown')
-                                            page_number = source.get('page', 0)
-                                            score = source.get('score', 0)
-                                            score_percentage = int(score * 100)
-
-                                            # Color code relevance
-                                            relevance_color = "#10b981"  # Green for high relevance
-                                            if score_percentage < 70:
-                                                relevance_color = "#f59e0b"  # Yellow for medium relevance
-                                            if score_percentage < 50:
-                                                relevance_color = "#ef4444"  # Red for low relevance
-
-                                            st.markdown(f"""
-                                            <div style='margin-bottom:8px; padding:8px; border-radius:4px; background-color:#f3f0f9;'>
-                                                <div style='font-weight:500;'>{i + 1}. {source_name}</div>
-                                                <div style='display:flex; justify-content:space-between; font-size:13px;'>
-                                                    <span>Page {page_number}</span>
-                                                    <span style='color:{relevance_color}; font-weight:500;'>Relevance: {score_percentage}%</span>
-                                                </div>
-                                            </div>
-                                            """, unsafe_allow_html=True)
-
-                                        st.markdown("---")
-        # Display thinking indicator with animation
-        if st.session_state.is_thinking:
-            with st.chat_message("assistant"):
-                st.markdown("""
-                <div style='display:flex; align-items:center;'>
-                    <div class='thinking-dot'></div>
-                    <div class='thinking-dot'></div>
-                    <div class='thinking-dot'></div>
-                    <span>Thinking...</span>
-                </div>
-                """, unsafe_allow_html=True)
+    # Chat messages - with improved styling
+    render_messages()
 
         # Chat input with better styling
-    user_input = st.chat_input("Type your message here...")
+    # One question at a time: a message sent while a query runs would never be answered
+    user_input = st.chat_input("Type your message here...", disabled=st.session_state.pending_query is not None)
     if current_chat_model == '__select__':
         st.error("Please Select Chat Model From Sidebar")
     if user_input:
-        logger.info(f"Received user input: {user_input[:50]}...")
-        user_name = st.session_state.get('name', 'Anonymous')  # Use 'name' not 'username'
-        logger.info(f"Adding message from user: {user_name}")
-
-        # Get the authenticated user's name
-
-
-        # Add user message with name
-        message_id = add_message(
-            st.session_state.current_conversation_id,
-            "user",  # Keep for LangChain compatibility
-            user_input,
-            user_name  # This should be the actual user name like "user1"
-        )
-
-        # Add user message to database
+        logger.info("Received user input: %s...", user_input[:50])
+        post_user_message(user_input)
+        st.rerun()
 
-        # Update conversation title if this is the first message
-        if len(st.session_state.messages) == 0:
-            # Use first few words (up to 30 chars) as the title
-            title = user_input[:30] + ('...' if len(user_input) > 30 else '')
-            update_conversation_title(st.session_state.current_conversation_id, title)
-            st.session_state.conversations = get_conversations()
-            logger.info(f"Updated conversation title to: {title}")
 
-        # Set thinking state and refresh
-        st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-        st.session_state.is_thinking = True
-        st.rerun()
+def stream_direct_answer(last_message, chat_model):
+    """Stream a direct answer into an assistant bubble; stream_direct_query saves it"""
+    # Cleared first: the reply is saved even if a click stops the script mid-stream, so it must not be retried
+    st.session_state.is_thinking = False
+    stream = stream_direct_query(
+        conversation_id=st.session_state.current_conversation_id,
+        query=last_message,
+        model_name=chat_model
+    )
+    try:
+        with st.chat_message("assistant"):
+            st.write_stream(stream)
+    finally:
+        # Close explicitly so an interrupted stream is saved before the messages are reloaded
+        stream.close()
+        load_recent_messages(st.session_state.current_conversation_id, fresh=True)
 
 
 def handle_ai_response():
     """Process the AI response when in thinking state"""
-    if st.session_state.is_thinking and st.session_state.messages:
-        # Get the last user message
-        last_message = None
+    pending = st.session_state.pending_query
+    if pending is not None and pending[0] != st.session_state.current_conversation_id:
+        # The running query belongs to a conversation the user switched away from; the worker
+        # saves its answer there, so only wait for it quietly and then drop it
+        if not pending[1].done():
+            query_progress(show=False)
+            return
+        st.session_state.pending_query = None
+        st.session_state.is_thinking = False
+        get_recent_messages_cached.clear()
+        return
 
-        for msg_id, role, content, user_name, timestamp in st.session_state.messages:
-            if role == "user":
-                last_message = content
+    if st.session_state.is_thinking and st.session_state.messages:
+        # Get the last user message; it is almost always at the end
+        last_message = next(
+            (content for _id, role, content, _user, _ts, _time in reversed(st.session_state.messages) if role == "user"),
+            None
+        )
 
         if not last_message:
             logger.warning("No user message found to respond to")
             st.session_state.is_thinking = False
             return
 
-        logger.info(f"Processing response to: {last_message[:50]}...")
+        logger.info("Processing response to: %s...", last_message[:50])
 
         # Get selected chat model
         chat_model = st.session_state.get('selected_chat_model', 'gpt-4o-mini')
-        logger.info(f"Using chat model: {chat_model}")
+        logger.info("Using chat model: %s", chat_model)
 
         # Check if we're in direct chat mode
         if st.session_state.direct_chat_mode:
             logger.info("Using direct chat mode")
-            try:
-                # Query directly with selected model
-                response = direct_openai_query(
-                    conversation_id=st.session_state.current_conversation_id,
-                    query=last_message,
-                    model_name=chat_model
-                )
-
-                logger.info("Direct response received")
-                st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-                st.session_state.is_thinking = False
-                st.rerun()
-            except Exception as e:
-                logger.exception(f"Error in direct chat mode: {str(e)}")
-                error_message = f"Error processing query: {str(e)}"
-                add_message(st.session_state.current_conversation_id, "assistant", error_message, "AI Assistant")
-                st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-                st.session_state.is_thinking = False
-                st.rerun()
+            # Query directly with selected model, rendering tokens as they arrive
+            stream_direct_answer(last_message, chat_model)
+            logger.info("Direct response received")
+            st.rerun()
 
         # RAG mode with knowledge base(s)
         elif st.session_state.selected_kbs:
-            try:
+            if pending is None:
                 # Get compatible embedding model based on selected chat model
                 # chat_model = st.session_state.get('selected_chat_model', 'gpt-4o-mini')
 
-                if chat_model.startswith("gpt"):
-                    embedding_model = "text-embedding-3-small"
-                elif chat_model.startswith("llama"):
-                    embedding_model = "llama3.2:latest"
-                elif chat_model.startswith("deepseek"):
-                    embedding_model = "deepseek-r1:latest"
-                elif chat_model.startswith("gemma"):
-                    embedding_model = "gemma2:2b"
-                else:
-                    embedding_model = "text-embedding-3-small"
+                embedding_model = get_compatible_embedding_model(chat_model)
 
                 retrieval_k = 4
 
-                logger.info(f"Using embedding model: {embedding_model}")
-                logger.info(f"Using chat model: {chat_model}")
-
-                # Use selected knowledge bases and chat model
-                if len(st.session_state.selected_kbs) > 0:
-                    logger.info(f"Using selected knowledge bases: {', '.join(st.session_state.selected_kbs)}")
-                    response = process_query(
-                        conversation_id=st.session_state.current_conversation_id,
-                        query=last_message,
-                        kb_names=st.session_state.selected_kbs,
-                        embedding_model=embedding_model,
-                        chat_model=chat_model,
-                        retrieval_k=retrieval_k
-                    )
+                logger.info("Using embedding model: %s", embedding_model)
+                logger.info("Using chat model: %s", chat_model)
 
+                # Run the query off the script thread; query_progress reruns the app when it is done
+                logger.info("Using selected knowledge bases: %s", ', '.join(st.session_state.selected_kbs))
+                query_kwargs = {}
+                if st.session_state.semantic_cache_enabled:
+                    query_fn = process_query_cached
+                    query_kwargs["cache"] = session_semantic_cache()
+                else:
+                    query_fn = process_query
+                future = get_query_executor().submit(
+                    query_fn,
+                    **query_kwargs,
+                    conversation_id=st.session_state.current_conversation_id,
+                    query=last_message,
+                    kb_names=list(st.session_state.selected_kbs),
+                    embedding_model=embedding_model,
+                    chat_model=chat_model,
+                    retrieval_k=retrieval_k
+                )
+                # Keyed by conversation so the result is only consumed where it was asked
+                st.session_state.pending_query = (st.session_state.current_conversation_id, future)
+                # Rerun so the chat input renders disabled while the query runs
+                st.rerun()
+            future = pending[1]
+            if not future.done():
+                query_progress()
+                return
+
+            st.session_state.pending_query = None
+            try:
+                future.result()
                 logger.info("RAG response received")
-                st.session_state.messages = get_messages(st.session_state.current_conversation_id)
+                load_recent_messages(st.session_state.current_conversation_id, fresh=True)
                 st.session_state.is_thinking = False
                 st.rerun()
             except Exception as e:
-                logger.exception(f"Error in RAG mode: {str(e)}")
+                logger.exception("Error in RAG mode: %s", str(e))
 
                 # Fallback to direct chat if KB error
                 if "Knowledge base" in str(e) and "does not exist" in str(e):
@@ -1108,16 +1396,16 @@ def handle_ai_response():
                             query=last_message,
                             model_name=chat_model
                         )
-                        st.session_state.messages = get_messages(st.session_state.current_conversation_id)
+                        load_recent_messages(st.session_state.current_conversation_id, fresh=True)
                         st.session_state.is_thinking = False
                         st.rerun()
                         return
                     except Exception as fallback_error:
-                        logger.exception(f"Error in fallback mode: {str(fallback_error)}")
+                        logger.exception("Error in fallback mode: %s", str(fallback_error))
 
                 error_message = f"Error processing query: {str(e)}"
                 add_message(st.session_state.current_conversation_id, "assistant", error_message, "AI Assistant")
-                st.session_state.messages = get_messages(st.session_state.current_conversation_id)
+                load_recent_messages(st.session_state.current_conversation_id, fresh=True)
                 st.session_state.is_thinking = False
                 st.rerun()
 
@@ -1126,33 +1414,20 @@ def handle_ai_response():
             logger.info("No knowledge base selected, switching to direct chat mode")
             st.session_state.direct_chat_mode = True
 
-            try:
-                # Use selected chat model instead of settings
-                response = direct_openai_query(
-                    conversation_id=st.session_state.current_conversation_id,
-                    query=last_message,
-                    model_name=chat_model
-                )
-
-                st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-                st.session_state.is_thinking = False
-                st.rerun()
-            except Exception as e:
-                logger.exception(f"Error in direct fallback mode: {str(e)}")
-                error_message = f"Error processing query: {str(e)}"
-                add_message(st.session_state.current_conversation_id, "assistant", error_message, "AI Assistant")
-                st.session_state.messages = get_messages(st.session_state.current_conversation_id)
-                st.session_state.is_thinking = False
-                st.rerun()
+            # Use selected chat model instead of settings
+            stream_direct_answer(last_message, chat_model)
+            st.rerun()
 
 
 def main():
     logger.info("Application starting")
+    add_custom_css()
 
     is_authenticated = authenticate_user()
     if is_authenticated:
     # Initialize session state
         init_session_state()
+        apply_upload_results()
 
         # Render sidebar
         sidebar()
@@ -8,8 +8,9 @@ import requests
 from langchain_openai import ChatOpenAI
 from langchain_ollama import ChatOllama
 from langchain_core.messages import HumanMessage
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import shutil
+import orjson
 
 
 # Import DB functions
@@ -23,6 +24,7 @@ from utils.database import (
     get_knowledge_bases
 )
 
+from utils.db_pool import close_all_pools
 from utils.document_processing import get_retriever, process_and_chunk_file, get_compatible_knowledge_bases, get_automatic_chunking_strategy
 
 app = FastAPI()
@@ -36,6 +38,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# utils.database connections come from a process-wide pool; release them with the server
+@app.on_event("shutdown")
+def close_database_pools():
+    close_all_pools()
+
 users_db = {}
 
 class UserAuth(BaseModel):
@@ -182,11 +189,18 @@ class AddMessageRequest(BaseModel):
     content: str
     user_name: str = None
 
+def to_message_out(row) -> MessageOut:
+    # Each row: (id, role, content, user_name, created_at)
+    return MessageOut(id=row[0], role=row[1], content=row[2], user_name=row[3], created_at=str(row[4]))
+
+def get_message_delta(conversation_id: int, last_message_id: Optional[int]) -> List[MessageOut]:
+    # Messages the client hasn't seen yet, so it can append instead of re-fetching the whole history
+    return [to_message_out(row) for row in db_get_messages(conversation_id, after_id=last_message_id)]
+
 @app.get("/messages", response_model=List[MessageOut])
 def get_messages(conversation_id: int):
     rows = db_get_messages(conversation_id)
-    # Each row: (id, role, content, user_name, created_at)
-    return [MessageOut(id=row[0], role=row[1], content=row[2], user_name=row[3], created_at=str(row[4])) for row in rows]
+    return [to_message_out(row) for row in rows]
 
 @app.post("/add/messages", response_model=MessageOut)
 def add_message(req: AddMessageRequest):
@@ -207,20 +221,28 @@ class DirectChatRequest(BaseModel):
     conversation_id: int
     query: str
     model_name: str = "gemma2:latest"
+    last_message_id: Optional[int] = None
 
 class DirectChatResponse(BaseModel):
     response: str
+    messages: List[MessageOut] = []
 
 # Helper: Call LLM using LangChain
 
-def call_langchain_chat(query, model_name):
+def get_chat_llm(model_name):
     if model_name.startswith("gpt"):
-        llm = ChatOpenAI(model=model_name)
-    else:
-        llm = ChatOllama(model=model_name)
-    response = llm.invoke([HumanMessage(content=query)])
+        return ChatOpenAI(model=model_name)
+    return ChatOllama(model=model_name)
+
+def call_langchain_chat(query, model_name):
+    response = get_chat_llm(model_name).invoke([HumanMessage(content=query)])
     return response.content
 
+def stream_langchain_chat(query, model_name):
+    for chunk in get_chat_llm(model_name).stream([HumanMessage(content=query)]):
+        if chunk.content:
+            yield chunk.content
+
 @app.post("/query/direct", response_model=DirectChatResponse)
 def direct_chat(req: DirectChatRequest):
     # Save user message
@@ -234,7 +256,41 @@ def direct_chat(req: DirectChatRequest):
     response = call_langchain_chat(req.query, req.model_name)
     # Save assistant message
     db_add_message(req.conversation_id, "assistant", response, user_name=None)
-    return DirectChatResponse(response=response)
+    return DirectChatResponse(response=response,
+                              messages=get_message_delta(req.conversation_id, req.last_message_id))
+
+@app.post("/query/direct/stream")
+def direct_chat_stream(req: DirectChatRequest):
+    # Same flow as /query/direct, but tokens are sent as Server-Sent Events while the LLM generates them
+    db_add_message(req.conversation_id, "user", req.query, user_name=None)
+    rows = db_get_messages(req.conversation_id)
+    user_msgs = [m for m in rows if m[1] == "user"]
+    if len(user_msgs) == 1:
+        auto_update_conversation_title(req.conversation_id)
+
+    def event_stream():
+        parts = []
+        try:
+            try:
+                for delta in stream_langchain_chat(req.query, req.model_name):
+                    parts.append(delta)
+                    yield b"data: " + orjson.dumps({'delta': delta}) + b"\n\n"
+            except Exception as e:
+                # Tell the client, and keep the error with whatever was already streamed
+                parts.append(("\n\n" if parts else "") + f"Error: {e}")
+                yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
+        finally:
+            # Save assistant message once the reply ends, even if the client disconnected mid-stream
+            if parts:
+                db_add_message(req.conversation_id, "assistant", "".join(parts), user_name=None)
+        try:
+            new_messages = get_message_delta(req.conversation_id, req.last_message_id)
+            yield b"data: " + orjson.dumps({'messages': [m.model_dump() for m in new_messages]}) + b"\n\n"
+        except Exception as e:
+            yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 # ------------------ RAG (Knowledge Base) Query ------------------
 class RAGQueryRequest(BaseModel):
@@ -244,6 +300,7 @@ class RAGQueryRequest(BaseModel):
     embedding_model: str
     chat_model: str
     retrieval_k: Optional[int] = 4
+    last_message_id: Optional[int] = None
 
 class SourceInfo(BaseModel):
     source: str
@@ -254,6 +311,7 @@ class SourceInfo(BaseModel):
 class RAGQueryResponse(BaseModel):
     response: str
     sources: Optional[List[SourceInfo]] = None
+    messages: List[MessageOut] = []
 
 @app.post("/query/rag", response_model=RAGQueryResponse)
 def rag_query(req: RAGQueryRequest):
@@ -293,7 +351,8 @@ def rag_query(req: RAGQueryRequest):
     response = call_langchain_chat(prompt, req.chat_model)
     # Save assistant message
     db_add_message(req.conversation_id, "assistant", response, user_name=None)
-    return RAGQueryResponse(response=response, sources=[SourceInfo(**s) for s in all_sources])
+    return RAGQueryResponse(response=response, sources=[SourceInfo(**s) for s in all_sources],
+                            messages=get_message_delta(req.conversation_id, req.last_message_id))
 
 
 
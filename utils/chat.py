@@ -4,25 +4,27 @@ import logging
 from typing import List, Dict, Any, Optional
 import yaml
 import os
-from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationalRetrievalChain
-from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
-from langchain_community.vectorstores import FAISS
-from langchain_ollama import ChatOllama
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 # Import from document_processing (this was missing)
-from utils.document_processing import initialize_embedding_model, get_retriever, ChatModel
+from utils.document_processing import initialize_embedding_model, get_retriever, load_faiss_index, ChatModel
 from utils.database import add_message, add_sources, get_messages, update_conversation_title
 # Setup logging
 logger = logging.getLogger("rag-chatbot.chat")
 
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 def load_settings(settings_path="settings.yml"):
     """Load settings from a YAML file."""
     try:
-        with open(settings_path, 'r') as file:
-            return yaml.safe_load(file)
+        # Re-parsed only when the file's modification time changes
+        return _parse_settings(settings_path, os.path.getmtime(settings_path))
     except Exception as e:
-        logger.error(f"Error loading settings file: {e}")
+        logger.error("Error loading settings file: %s", e)
         # Return default settings
         return {
             "chat_model": "gpt-4o-mini",
@@ -34,9 +36,36 @@ def load_settings(settings_path="settings.yml"):
             }
         }
 
+@lru_cache(maxsize=4)
+def _parse_settings(settings_path: str, mtime: float):
+    with open(settings_path, 'r') as file:
+        return yaml.load(file, Loader=YamlLoader)
+
+
+def get_chat_llm(model_name: str):
+    """Return the shared chat model client for model_name."""
+    # Keyed on the API key too, so a key entered in the UI gets a fresh client
+    return _create_chat_llm(model_name, os.getenv("OPENAI_API_KEY"))
+
+
+@lru_cache(maxsize=8)
+def _create_chat_llm(model_name: str, api_key: Optional[str]):
+    if model_name.startswith("gpt"):
+        # OpenAI models
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model_name=model_name, temperature=0.7)
+    # Ollama models using new langchain_ollama
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=model_name, temperature=0.7)
+
+
 def get_conversation_chain(kb_name: str, embedding_model: str, chat_model: str, retrieval_k: int = 4):
     """Create a conversational chain for the RAG system."""
-    logger.info(f"Creating conversation chain with KB: {kb_name}, model: {chat_model}")
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain.prompts import PromptTemplate
+    from langchain.memory import ConversationBufferMemory
+
+    logger.info("Creating conversation chain with KB: %s, model: %s", kb_name, chat_model)
     
     try:
         # Get the retriever for the knowledge base
@@ -48,8 +77,8 @@ def get_conversation_chain(kb_name: str, embedding_model: str, chat_model: str,
         )
         
         # Initialize the LLM
-        llm = ChatOpenAI(model_name=chat_model, temperature=0.7)
-        logger.debug(f"Initialized ChatOpenAI with model: {chat_model}")
+        llm = get_chat_llm(chat_model)
+        logger.debug("Using chat model: %s", chat_model)
         
         # Create system prompt template with better context handling
         template = """
@@ -96,28 +125,138 @@ def get_conversation_chain(kb_name: str, embedding_model: str, chat_model: str,
         logger.info("Conversation chain created successfully")
         return chain
     except Exception as e:
-        logger.exception(f"Error creating conversation chain: {str(e)}")
+        logger.exception("Error creating conversation chain: %s", str(e))
         raise
 
 
+def _query_knowledge_base(current_kb: str, query: str, query_vector: List[float], embedding_model: str,
+                          chat_model: str, retrieval_k: int):
+    """Search one knowledge base with a precomputed query embedding and answer from its documents.
+
+    Returns (kb_docs, answer); answer is None when the KB yielded nothing usable.
+    """
+    from langchain.schema import Document
+
+    try:
+        logger.info("Processing KB: %s", current_kb)
+
+        kb_path = f"{ChatModel(chat_model).folder_name()}/FAISS_Index/{current_kb}"
+
+        # Load vectorstore directly
+        try:
+            vectorstore = load_faiss_index(kb_path, embedding_model)
+            logger.info("Loaded vectorstore from: %s", kb_path)
+        except Exception as load_error:
+            logger.error("Failed to load vectorstore from %s: %s", kb_path, load_error)
+            return [], None
+
+        # Get relevant documents directly with similarity scores
+        try:
+            docs_and_scores = vectorstore.similarity_search_with_score_by_vector(query_vector, k=retrieval_k)
+            logger.info("Retrieved %s documents from %s", len(docs_and_scores), current_kb)
+
+            # Debug: Log the first few results
+            for i, (doc, score) in enumerate(docs_and_scores[:2]):  # Just first 2
+                logger.debug("Doc %s: score=%.4f, content_preview=%s...", i, score, doc.page_content[:100])
+
+        except Exception as search_error:
+            logger.error("Failed to search in %s: %s", current_kb, search_error)
+            return [], None
+
+        if not docs_and_scores:
+            logger.warning("No documents retrieved from %s for query: %s", current_kb, query)
+            return [], None
+
+        # Process the retrieved documents
+        kb_docs = []
+        for doc, score in docs_and_scores:
+            # Calculate a true relevance score (convert distance to similarity)
+            relevance = 1.0 / (1.0 + float(score))
+
+            # Annotate a copy; the documents belong to the shared cached index
+            kb_docs.append(Document(
+                page_content=doc.page_content,
+                metadata={**doc.metadata, 'kb_name': current_kb, 'score': relevance, 'raw_score': float(score)}
+            ))
+            logger.debug("Added doc with score: %.4f", relevance)
+
+        logger.info("Processing %s documents from %s", len(kb_docs), current_kb)
+
+        # Initialize the LLM with proper handling for different models
+        try:
+            llm = get_chat_llm(chat_model)
+
+            logger.info("Initialized LLM: %s", chat_model)
+        except Exception as llm_error:
+            logger.error("Failed to initialize LLM %s: %s", chat_model, llm_error)
+            return kb_docs, None
+
+        # Create context from the top documents
+        context = "\n\n".join([
+            f"Document: {doc.metadata.get('source', 'Unknown')}, "
+            f"Page: {doc.metadata.get('page', 0) + 1}, "
+            f"Knowledge Base: {current_kb}\n{doc.page_content}"
+            for doc in kb_docs[:retrieval_k]
+        ])
+
+        logger.info("Created context with %s characters", len(context))
+
+        # Create system prompt
+        template = f"""
+        You are an Enterprise RAG (Retrieval-Augmented Generation) Chatbot providing helpful information based on the documents in the knowledge base.
+
+        Use the following context to answer the question. If you don't know the answer, just say you don't know. Don't try to make up an answer.
+
+        Always provide page numbers and document names as source citations.
+
+        Context:
+        {context}
+
+        Question: {query}
+
+        Answer:
+        """
+
+        # Get response from LLM
+        try:
+            messages = [{"role": "system", "content": template}]
+            response = llm.invoke(messages)
+
+            if hasattr(response, 'content'):
+                answer = response.content
+            else:
+                answer = str(response)
+
+            logger.info("Got answer of length %s from %s", len(answer), current_kb)
+            return kb_docs, answer
+        except Exception as llm_error:
+            logger.error("LLM failed to generate answer: %s", llm_error)
+            return kb_docs, None
+    except Exception as kb_error:
+        logger.error("Error querying KB %s: %s", current_kb, str(kb_error))
+        import traceback
+        logger.debug("KB error traceback: %s", traceback.format_exc())
+        return [], None
+
+
 # Fix the process_query function in chat.py:
 
 def process_query(conversation_id: int, query: str, kb_name: str = None, kb_names: list = None,
                   embedding_model: str = "text-embedding-3-small", chat_model: str = "gpt-4o-mini",
-                  retrieval_k: int = 4):
+                  retrieval_k: int = 4, query_vector: List[float] = None):
     """Process a user query and generate a response with sources from multiple knowledge bases."""
-    logger.info(f"Processing query for conversation: {conversation_id}")
-    logger.info(f"Using embedding model: {embedding_model}")  # ADD THIS
-    logger.info(f"Using chat model: {chat_model}")
+    logger.info("Processing query for conversation: %s", conversation_id)
+    logger.info("Using embedding model: %s", embedding_model)  # ADD THIS
+    logger.info("Using chat model: %s", chat_model)
 
     # If kb_names is provided, use all selected KBs instead of just the active one
     if kb_names and len(kb_names) > 0:
         using_multiple_kbs = True
-        logger.info(f"Using multiple knowledge bases: {', '.join(kb_names)}")
+        logger.info("Using multiple knowledge bases: %s", ', '.join(kb_names))
     elif kb_name:
         kb_names = [kb_name]
         using_multiple_kbs = False
-        logger.info(f"Using single knowledge base: {kb_name}")
+        logger.info("Using single knowledge base: %s", kb_name)
     else:
         logger.error("No knowledge base specified")
         raise ValueError("No knowledge base specified")
@@ -130,161 +269,34 @@ def process_query(conversation_id: int, query: str, kb_name: str = None, kb_name
         queried_kb_count = 0
         successful_kb_count = 0
 
-        # Query each knowledge base
-        for current_kb in kb_names:
-            try:
-                queried_kb_count += 1
-                logger.info(f"Processing KB: {current_kb}")
-
-                # OPTION 1: If using new folder structure, use this:
-                # from utils.document_processing import get_faiss_index_path
-                # kb_path = get_faiss_index_path(current_kb, embedding_model)
-
-                # OPTION 2: For current setup, check multiple possible paths:
-                chat_model_enum = ChatModel(chat_model)
-                model_folder = chat_model_enum.folder_name()
-                # kb_path =
-                possible_paths =f"{model_folder}/FAISS_Index/{current_kb}"
-
-                kb_path = possible_paths
-
-
-                if not kb_path:
-                    logger.warning(f"Knowledge base {current_kb} not found in any location")
-                    logger.debug(f"Searched paths: {possible_paths}")
-                    continue
-
-                # Initialize embedding model
-                try:
-                    embeddings = initialize_embedding_model(embedding_model)
-                    logger.info(f"Initialized embedding model: {embedding_model}")
-                except Exception as embed_error:
-                    logger.error(f"Failed to initialize embedding model {embedding_model}: {embed_error}")
-                    continue
-
-                # Load vectorstore directly
-                try:
-                    vectorstore = FAISS.load_local(
-                        folder_path=kb_path,
-                        embeddings=embeddings,
-                        allow_dangerous_deserialization=True
-                    )
-                    logger.info(f"Loaded vectorstore from: {kb_path}")
-                except Exception as load_error:
-                    logger.error(f"Failed to load vectorstore from {kb_path}: {load_error}")
-                    continue
-
-                # Get relevant documents directly with similarity scores
-                try:
-                    docs_and_scores = vectorstore.similarity_search_with_score(query, k=retrieval_k)
-                    logger.info(f"Retrieved {len(docs_and_scores)} documents from {current_kb}")
-
-                    # Debug: Log the first few results
-                    for i, (doc, score) in enumerate(docs_and_scores[:2]):  # Just first 2
-                        logger.debug(f"Doc {i}: score={score:.4f}, content_preview={doc.page_content[:100]}...")
-
-                except Exception as search_error:
-                    logger.error(f"Failed to search in {current_kb}: {search_error}")
-                    continue
-
-                # Only add documents if we got results
-                if docs_and_scores:
-                    # Process the retrieved documents
-                    kb_docs = []
-                    for doc, score in docs_and_scores:
-                        # Calculate a true relevance score (convert distance to similarity)
-                        relevance = 1.0 / (1.0 + float(score))
-
-                        # Add metadata
-                        doc.metadata['kb_name'] = current_kb
-                        doc.metadata['score'] = relevance
-                        doc.metadata['raw_score'] = float(score)
-
-                        kb_docs.append(doc)
-                        logger.debug(f"Added doc with score: {relevance:.4f}")
-
-                    # Store documents for this KB
-                    all_kb_docs[current_kb] = kb_docs
-                    all_source_docs.extend(kb_docs)
-                    logger.info(f"Added {len(kb_docs)} documents to collection")
-
-                    # CRITICAL: Only try to get an answer if we have documents
-                    if kb_docs:
-                        logger.info(f"Processing {len(kb_docs)} documents from {current_kb}")
-
-                        # Initialize the LLM with proper handling for different models
-                        try:
-                            if chat_model.startswith("gpt"):
-                                from langchain_openai import ChatOpenAI
-                                llm = ChatOpenAI(model_name=chat_model, temperature=0.7)
-                            else:
-                                from langchain_ollama import ChatOllama
-                                llm = ChatOllama(model=chat_model, temperature=0.7)
-
-                            logger.info(f"Initialized LLM: {chat_model}")
-                        except Exception as llm_error:
-                            logger.error(f"Failed to initialize LLM {chat_model}: {llm_error}")
-                            continue
-
-                        # Create context from the top documents
-                        context = "\n\n".join([
-                            f"Document: {doc.metadata.get('source', 'Unknown')}, "
-                            f"Page: {doc.metadata.get('page', 0) + 1}, "
-                            f"Knowledge Base: {current_kb}\n{doc.page_content}"
-                            for doc in kb_docs[:retrieval_k]
-                        ])
-
-                        logger.info(f"Created context with {len(context)} characters")
-
-                        # Create system prompt
-                        template = f"""
-                        You are an Enterprise RAG (Retrieval-Augmented Generation) Chatbot providing helpful information based on the documents in the knowledge base.
-
-                        Use the following context to answer the question. If you don't know the answer, just say you don't know. Don't try to make up an answer.
-
-                        Always provide page numbers and document names as source citations.
-
-                        Context:
-                        {context}
-
-                        Question: {query}
-
-                        Answer:
-                        """
-
-                        # Get response from LLM
-                        try:
-                            messages = [{"role": "system", "content": template}]
-                            response = llm.invoke(messages)
-
-                            if hasattr(response, 'content'):
-                                answer = response.content
-                            else:
-                                answer = str(response)
-
-                            logger.info(f"Got answer of length {len(answer)} from {current_kb}")
-                            all_answers.append((current_kb, answer))
-                            successful_kb_count += 1
-                        except Exception as llm_error:
-                            logger.error(f"LLM failed to generate answer: {llm_error}")
-                            continue
-                    else:
-                        logger.warning(f"No valid documents found in {current_kb} after processing")
-                else:
-                    logger.warning(f"No documents retrieved from {current_kb} for query: {query}")
-            except Exception as kb_error:
-                logger.error(f"Error querying KB {current_kb}: {str(kb_error)}")
-                import traceback
-                logger.debug(f"KB error traceback: {traceback.format_exc()}")
-                continue
+        # Embed the query once and search every knowledge base concurrently;
+        # each one is an independent FAISS search plus an LLM call
+        if query_vector is None:
+            query_vector = initialize_embedding_model(embedding_model).embed_query(query)
+        with ThreadPoolExecutor(max_workers=min(len(kb_names), 8)) as executor:
+            kb_results = list(executor.map(
+                lambda current_kb: _query_knowledge_base(current_kb, query, query_vector, embedding_model,
+                                                         chat_model, retrieval_k),
+                kb_names
+            ))
+
+        # Merge in selection order so single-answer and source ordering stay deterministic
+        for current_kb, (kb_docs, kb_answer) in zip(kb_names, kb_results):
+            queried_kb_count += 1
+            if kb_docs:
+                all_kb_docs[current_kb] = kb_docs
+                all_source_docs.extend(kb_docs)
+            if kb_answer is not None:
+                all_answers.append((current_kb, kb_answer))
+                successful_kb_count += 1
 
         # Add detailed logging before determining final answer
-        logger.info(f"=== FINAL PROCESSING SUMMARY ===")
-        logger.info(f"Total answers collected: {len(all_answers)}")
-        logger.info(f"Successful KB count: {successful_kb_count}")
-        logger.info(f"Queried KB count: {queried_kb_count}")
-        logger.info(f"Total source documents: {len(all_source_docs)}")
-        logger.info(f"All KB docs keys: {list(all_kb_docs.keys())}")
+        logger.info("=== FINAL PROCESSING SUMMARY ===")
+        logger.info("Total answers collected: %s", len(all_answers))
+        logger.info("Successful KB count: %s", successful_kb_count)
+        logger.info("Queried KB count: %s", queried_kb_count)
+        logger.info("Total source documents: %s", len(all_source_docs))
+        logger.info("All KB docs keys: %s", list(all_kb_docs.keys()))
 
         # Sort documents by relevance score
         all_source_docs.sort(key=lambda doc: doc.metadata.get('score', 0), reverse=True)
@@ -298,17 +310,17 @@ def process_query(conversation_id: int, query: str, kb_name: str = None, kb_name
                 seen_sources.add(source_key)
                 unique_source_docs.append(doc)
 
-        logger.info(f"Unique source documents: {len(unique_source_docs)}")
+        logger.info("Unique source documents: %s", len(unique_source_docs))
 
         # Determine the final answer
         if len(all_answers) == 0:
-            logger.error(f"No answers generated despite processing {queried_kb_count} KBs")
+            logger.error("No answers generated despite processing %s KBs", queried_kb_count)
             answer = f"I couldn't find any relevant information in the {queried_kb_count} selected knowledge bases. Please check if these knowledge bases contain the information you're looking for, or try rephrasing your question."
         elif len(all_answers) == 1:
             answer = all_answers[0][1]
-            logger.info(f"Using single answer from {all_answers[0][0]}")
+            logger.info("Using single answer from %s", all_answers[0][0])
         else:
-            logger.info(f"Synthesizing {len(all_answers)} answers")
+            logger.info("Synthesizing %s answers", len(all_answers))
             # ... existing synthesis logic ...
 
         # Format sources with detailed information
@@ -325,7 +337,7 @@ def process_query(conversation_id: int, query: str, kb_name: str = None, kb_name
             }
             query_relevant_sources.append(source)
 
-        logger.info(f"Final query_relevant_sources count: {len(query_relevant_sources)}")
+        logger.info("Final query_relevant_sources count: %s", len(query_relevant_sources))
 
         # Process documents by KB for the KB-specific tab
         for kb_name, docs in all_kb_docs.items():
@@ -355,12 +367,12 @@ def process_query(conversation_id: int, query: str, kb_name: str = None, kb_name
 
         # Combine all sources for database storage
         all_sources = query_relevant_sources
-        logger.info(f"Adding {len(all_sources)} sources to database")
+        logger.info("Adding %s sources to database", len(all_sources))
 
         # Add sources to database
         if all_sources:
             add_sources(assistant_message_id, all_sources)
-            logger.debug(f"Added {len(all_sources)} sources to message {assistant_message_id}")
+            logger.debug("Added %s sources to message %s", len(all_sources), assistant_message_id)
         else:
             logger.warning("No sources to add to database!")
 
@@ -370,10 +382,11 @@ def process_query(conversation_id: int, query: str, kb_name: str = None, kb_name
                 "query_relevant": query_relevant_sources,
                 "kb_specific": kb_sources
             },
-            "message_id": assistant_message_id
+            "message_id": assistant_message_id,
+            "answer_count": len(all_answers)
         }
     except Exception as e:
-        logger.exception(f"Error processing query: {str(e)}")
+        logger.exception("Error processing query: %s", str(e))
         error_message = f"I encountered an error while processing your query: {str(e)}"
         message_id = add_message(conversation_id, "assistant", error_message, f"AI Assistant ({chat_model})")
         return {
@@ -384,40 +397,82 @@ def process_query(conversation_id: int, query: str, kb_name: str = None, kb_name
         }
 
 
+def process_query_cached(cache, conversation_id: int, query: str, kb_names: list,
+                         embedding_model: str = "text-embedding-3-small", chat_model: str = "gpt-4o-mini",
+                         retrieval_k: int = 4):
+    """process_query, answered from a SemanticCache when a near-identical question was already answered
+    in the same conversation."""
+    # A hit is only valid in the same conversation, with the same knowledge bases and models
+    scope = (conversation_id, tuple(sorted(kb_names)), chat_model, embedding_model)
+    query_vector = initialize_embedding_model(embedding_model).embed_query(query)
+
+    hit = cache.lookup(scope, query_vector)
+    if hit is not None:
+        logger.info("Answering from the semantic cache")
+        message_id = add_message(conversation_id, "assistant", hit["content"], f"AI Assistant ({chat_model})")
+        if hit["sources"]:
+            add_sources(message_id, hit["sources"])
+        return {
+            "content": hit["content"],
+            "sources": {"query_relevant": hit["sources"], "kb_specific": {}},
+            "message_id": message_id,
+            "cached": True
+        }
+
+    result = process_query(
+        conversation_id=conversation_id,
+        query=query,
+        kb_names=kb_names,
+        embedding_model=embedding_model,
+        chat_model=chat_model,
+        retrieval_k=retrieval_k,
+        query_vector=query_vector
+    )
+    # Don't keep the "couldn't find any relevant information" fallback; the KBs may get that content later
+    if "error" not in result and result.get("answer_count"):
+        cache.add(scope, query_vector, result["content"], result["sources"]["query_relevant"])
+    return result
+
+
+def invalidate_semantic_cache(cache, kb_names) -> None:
+    """Drop cached answers of every conversation scope that queried one of kb_names."""
+    changed = set(kb_names)
+    cache.drop_scopes(lambda scope: not changed.isdisjoint(scope[1]))
+
+
+def _direct_chat_messages(conversation_id: int, model_name: str) -> List[Dict[str, str]]:
+    """Build the system prompt plus conversation history for a direct query."""
+    # Simple system prompt for direct conversation
+    system_message = f"""
+    You are a helpful AI assistant powered by {model_name}. Provide informative, accurate, and helpful responses to the user's questions.
+    If you don't know the answer to something, be honest about it rather than making up information.
+    """
+
+    # Get message history
+    messages = get_messages(conversation_id)
+    formatted_messages = []
+
+    # Add system message
+    formatted_messages.append({"role": "system", "content": system_message})
+
+    # Add conversation history (excluding system messages)
+    for msg_id, role, content, user_name, timestamp in messages:
+        if role != "system":
+            formatted_messages.append({"role": role, "content": content})
+    return formatted_messages
+
+
 def direct_openai_query(conversation_id: int, query: str, model_name: str = "gpt-4o-mini"):
     """Process a direct query to LLM without using a knowledge base."""
-    logger.info(f"Processing direct query with model: {model_name}")
+    logger.info("Processing direct query with model: %s", model_name)
 
     try:
         # Initialize the appropriate LLM based on model name
-        if model_name.startswith("gpt"):
-            # OpenAI models
-            llm = ChatOpenAI(model_name=model_name, temperature=0.7)
-        else:
-            # Ollama models using new langchain_ollama
-            llm = ChatOllama(model=model_name, temperature=0.7)
-
-        # Simple system prompt for direct conversation
-        system_message = f"""
-        You are a helpful AI assistant powered by {model_name}. Provide informative, accurate, and helpful responses to the user's questions.
-        If you don't know the answer to something, be honest about it rather than making up information.
-        """
-
-        # Get message history
-        messages = get_messages(conversation_id)
-        formatted_messages = []
-
-        # Add system message
-        formatted_messages.append({"role": "system", "content": system_message})
-
-        # Add conversation history (excluding system messages)
-        for msg_id, role, content, user_name, timestamp in messages:
-            if role != "system":
-                formatted_messages.append({"role": role, "content": content})
+        llm = get_chat_llm(model_name)
 
         # Process the query
-        logger.debug(f"Sending query to {model_name}: {query[:50]}...")
-        response = llm.invoke(formatted_messages)
+        logger.debug("Sending query to %s: %s...", model_name, query[:50])
+        response = llm.invoke(_direct_chat_messages(conversation_id, model_name))
 
         # Handle different response types
         if hasattr(response, 'content'):
@@ -425,7 +480,7 @@ def direct_openai_query(conversation_id: int, query: str, model_name: str = "gpt
         else:
             answer = str(response)
 
-        logger.debug(f"Received answer of length: {len(answer)}")
+        logger.debug("Received answer of length: %s", len(answer))
 
         # Add assistant message to database with proper assistant name
         assistant_message_id = add_message(
@@ -440,7 +495,7 @@ def direct_openai_query(conversation_id: int, query: str, model_name: str = "gpt
             "message_id": assistant_message_id
         }
     except Exception as e:
-        logger.exception(f"Error in direct query with {model_name}: {str(e)}")
+        logger.exception("Error in direct query with %s: %s", model_name, str(e))
         error_message = f"I encountered an error while processing your query with {model_name}: {str(e)}"
         message_id = add_message(
             conversation_id,
@@ -454,6 +509,32 @@ def direct_openai_query(conversation_id: int, query: str, model_name: str = "gpt
             "error": str(e)
         }
 
+def stream_direct_query(conversation_id: int, query: str, model_name: str = "gpt-4o-mini"):
+    """Stream a direct LLM answer token by token and save it when the stream ends.
+
+    The answer is saved even if the consumer stops early (the generator is closed), so text already
+    shown to the user is never lost; a failure saves the partial answer followed by the error.
+    """
+    logger.info("Streaming direct query with model: %s", model_name)
+    parts = []
+    try:
+        llm = get_chat_llm(model_name)
+        logger.debug("Sending query to %s: %s...", model_name, query[:50])
+        for chunk in llm.stream(_direct_chat_messages(conversation_id, model_name)):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        logger.debug("Received answer of length: %s", sum(len(part) for part in parts))
+    except Exception as e:
+        logger.exception("Error in direct query with %s: %s", model_name, str(e))
+        error_message = f"I encountered an error while processing your query with {model_name}: {str(e)}"
+        parts.append(("\n\n" if parts else "") + error_message)
+        yield parts[-1]
+    finally:
+        answer = "".join(parts)
+        if answer:
+            add_message(conversation_id, "assistant", answer, f"AI Assistant ({model_name})")
+
 def format_sources(source_docs):
     """Format source documents for display with enhanced information."""
     sources = []
@@ -0,0 +1,129 @@
+"""Process-wide PostgreSQL connection pools for the RAG Chatbot."""
+
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+MIN_CONNECTIONS = 2
+MAX_CONNECTIONS = 20
+# Seconds a borrower waits for a free connection before giving up
+POOL_TIMEOUT = 30
+
+# One pool per DSN, created on first use
+_pools: Dict[str, "BlockingConnectionPool"] = {}
+_pools_lock = threading.Lock()
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool that waits for a free connection instead of raising PoolError at once."""
+
+    def __init__(self, minconn, maxconn, *args, timeout: float = POOL_TIMEOUT, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolError(f"no database connection became free within {self._timeout}s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+class PooledConnection:
+    """A borrowed connection; close() hands it back to its pool instead of disconnecting.
+
+    Everything else is forwarded to the psycopg2 connection, so existing
+    connect/use/close code works unchanged.
+    """
+
+    def __init__(self, pool: BlockingConnectionPool, conn):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_returned", False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def __del__(self):
+        # Safety net for error paths that drop a connection without closing it
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def close(self):
+        if self._returned:
+            return
+        object.__setattr__(self, "_returned", True)
+        conn = self._conn
+        if conn.closed:
+            self._pool.putconn(conn, close=True)
+            return
+        # putconn rolls back an open transaction; reset session flags the borrower may have changed
+        if conn.autocommit or conn.readonly:
+            conn.rollback()
+            conn.autocommit = False
+            conn.readonly = None
+        self._pool.putconn(conn)
+
+
+def has_pool(dsn: str) -> bool:
+    return dsn in _pools
+
+
+def get_pool(dsn: str) -> BlockingConnectionPool:
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = _pools[dsn] = BlockingConnectionPool(MIN_CONNECTIONS, MAX_CONNECTIONS, dsn=dsn)
+    return pool
+
+
+def borrow_connection(dsn: str) -> PooledConnection:
+    """Take a connection from the pool for dsn; call close() on it to give it back."""
+    pool = get_pool(dsn)
+    conn = pool.getconn()
+    if conn.closed:
+        # The server dropped it while it sat idle in the pool
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return PooledConnection(pool, conn)
+
+
+@contextmanager
+def get_conn(dsn: str):
+    conn = borrow_connection(dsn)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def close_all_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
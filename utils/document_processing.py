@@ -1,23 +1,23 @@
 """Document processing functions for the RAG Chatbot."""
 
 import os
+import re
 import tempfile
 import shutil
 import logging
 import base64
-from typing import Dict, List, Any, Optional
+import traceback
+from typing import TYPE_CHECKING, Dict, List, Any, Optional
 from enum import Enum
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import urllib.request
 import urllib.error
 
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain_ollama import OllamaEmbeddings
-from langchain.text_splitter import (CharacterTextSplitter, RecursiveCharacterTextSplitter)
-# from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
+# LangChain modules are imported inside the functions that use them so that importing this
+# module (e.g. for the enums) stays cheap on app start
+if TYPE_CHECKING:
+    from langchain.schema import Document
 
 from utils.database import register_document, register_knowledge_base, get_knowledge_bases
 
@@ -46,30 +46,47 @@ class ChatModel(Enum):
         }
         return folder_map[self]
 
+# Embedding model whose indexes each chat model family queries, keyed by the model name's leading letters
+_CHAT_FAMILY_RE = re.compile(r"[a-z]+")
+_EMBEDDING_BY_CHAT_FAMILY = {
+    "gpt": "text-embedding-3-small",
+    "llama": "llama3.2:latest",
+    "deepseek": "deepseek-r1:latest",
+    "gemma": "gemma2:2b",
+}
+
+
+def get_compatible_embedding_model(chat_model: str) -> str:
+    """Get the embedding model matching a chat model, defaulting to OpenAI's."""
+    family = _CHAT_FAMILY_RE.match(chat_model or "")
+    return _EMBEDDING_BY_CHAT_FAMILY.get(family.group() if family else None, "text-embedding-3-small")
+
 def load_pdf_with_pages(file):
     """Load a PDF file and extract content with page numbers."""
-    logger.info(f"Loading PDF file: {file.name}")
+    from langchain_community.document_loaders import PyPDFLoader
+
+    logger.info("Loading PDF file: %s", file.name)
     
     suffix = os.path.splitext(file.name)[1]
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
         try:
-            # Save the uploaded file to a temporary file
-            file_content = file.read()
+            # Stream the upload to a temporary file in 1 MB chunks instead of holding a second copy in memory
+            file.seek(0)
+            shutil.copyfileobj(file, temp_file, length=1024 * 1024)
             file.seek(0)  # Reset the file pointer for future use
-            
+
             # Validate file is not corrupted
-            if len(file_content) == 0:
-                logger.error(f"File {file.name} is empty")
+            if temp_file.tell() == 0:
+                logger.error("File %s is empty", file.name)
                 raise ValueError(f"Uploaded file {file.name} is empty")
-                
-            temp_file.write(file_content)
+
             temp_file.flush()
-            logger.debug(f"Saved file to temporary location: {temp_file.name}")
+            logger.debug("Saved file to temporary location: %s", temp_file.name)
 
             # Use PyPDFLoader to load PDF content
             loader = PyPDFLoader(temp_file.name)
             documents = loader.load()
-            logger.debug(f"Loaded {len(documents)} pages from PDF")
+            logger.debug("Loaded %s pages from PDF", len(documents))
 
             # Extract content and page numbers
             pages = []
@@ -85,39 +102,41 @@ def load_pdf_with_pages(file):
                 "pages": pages
             }
         except Exception as e:
-            logger.exception(f"Error loading PDF file {file.name}: {str(e)}")
+            logger.exception("Error loading PDF file %s: %s", file.name, str(e))
             raise
         finally:
             try:
                 os.unlink(temp_file.name)
-                logger.debug(f"Removed temporary file: {temp_file.name}")
+                logger.debug("Removed temporary file: %s", temp_file.name)
             except Exception as e:
-                logger.warning(f"Failed to remove temporary file {temp_file.name}: {str(e)}")
+                logger.warning("Failed to remove temporary file %s: %s", temp_file.name, str(e))
 
 def load_docx_with_pages(file):
     """Load a DOCX file and extract content with page numbers."""
-    logger.info(f"Loading DOCX file: {file.name}")
+    from langchain_community.document_loaders import Docx2txtLoader
+
+    logger.info("Loading DOCX file: %s", file.name)
     
     suffix = os.path.splitext(file.name)[1]
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
         try:
-            # Save the uploaded file to a temporary file
-            file_content = file.read()
+            # Stream the upload to a temporary file in 1 MB chunks instead of holding a second copy in memory
+            file.seek(0)
+            shutil.copyfileobj(file, temp_file, length=1024 * 1024)
             file.seek(0)  # Reset the file pointer for future use
-            
+
             # Validate file is not corrupted
-            if len(file_content) == 0:
-                logger.error(f"File {file.name} is empty")
+            if temp_file.tell() == 0:
+                logger.error("File %s is empty", file.name)
                 raise ValueError(f"Uploaded file {file.name} is empty")
-                
-            temp_file.write(file_content)
+
             temp_file.flush()
-            logger.debug(f"Saved file to temporary location: {temp_file.name}")
+            logger.debug("Saved file to temporary location: %s", temp_file.name)
 
             # Use Docx2txtLoader to load DOCX content
             loader = Docx2txtLoader(temp_file.name)
             documents = loader.load()
-            logger.debug(f"Loaded {len(documents)} sections from DOCX")
+            logger.debug("Loaded %s sections from DOCX", len(documents))
 
             # Extract content and page numbers
             pages = []
@@ -132,30 +151,39 @@ def load_docx_with_pages(file):
                 "pages": pages
             }
         except Exception as e:
-            logger.exception(f"Error loading DOCX file {file.name}: {str(e)}")
+            logger.exception("Error loading DOCX file %s: %s", file.name, str(e))
             raise
         finally:
             try:
                 os.unlink(temp_file.name)
-                logger.debug(f"Removed temporary file: {temp_file.name}")
+                logger.debug("Removed temporary file: %s", temp_file.name)
             except Exception as e:
-                logger.warning(f"Failed to remove temporary file {temp_file.name}: {str(e)}")
+                logger.warning("Failed to remove temporary file %s: %s", temp_file.name, str(e))
 
 
 def initialize_embedding_model(embedding_model):
     """Initialize the embedding model based on the model name."""
     # Clean the model name
     embedding_model = embedding_model.strip()
+    # Keyed on the API key too, so a key entered in the UI gets a fresh client
+    return _create_embedding_model(embedding_model, os.getenv("OPENAI_API_KEY"))
 
-    logger.info(f"Initializing embedding model: {embedding_model}")
+
+@lru_cache(maxsize=8)
+def _create_embedding_model(embedding_model, api_key):
+    """Build an embedding client once per model so its HTTP connections are reused."""
+    from langchain_openai import OpenAIEmbeddings
+    from langchain_ollama import OllamaEmbeddings
+
+    logger.info("Initializing embedding model: %s", embedding_model)
 
     try:
         if embedding_model.startswith("text"):  # OpenAI models
             # Fast-fail if OpenAI key is missing
-            if not os.getenv("OPENAI_API_KEY"):
+            if not api_key:
                 raise ValueError("OPENAI_API_KEY is not set in environment")
             embeddings = OpenAIEmbeddings(model=embedding_model)
-            logger.debug(f"Initialized OpenAI embedding model: {embedding_model}")
+            logger.debug("Initialized OpenAI embedding model: %s", embedding_model)
             return embeddings
         elif embedding_model.startswith("llama"):
             # Ensure Ollama is reachable to avoid long hangs
@@ -168,12 +196,12 @@ def initialize_embedding_model(embedding_model):
 
             # Use langchain_ollama for Llama models
             embeddings = OllamaEmbeddings(model=embedding_model)
-            logger.debug(f"Initialized Ollama embedding model: {embedding_model}")
+            logger.debug("Initialized Ollama embedding model: %s", embedding_model)
             return embeddings
         else:  # Default to unsupported models
             return "Please Select Embedding model"
     except Exception as e:
-        logger.exception(f"Error initializing embedding model {embedding_model}: {str(e)}")
+        logger.exception("Error initializing embedding model %s: %s", embedding_model, str(e))
         raise
 
 
@@ -188,26 +216,29 @@ def create_chunking(
         embedding_model_name="text-embedding-3-small"  # ADD THIS PARAMETER
 ):
     """Create document chunks based on the specified chunking strategy."""
-    logger.info(f"Creating chunks with strategy: {chunking_type}")
-    logger.debug(f"Documents to chunk: {len(documents)}")
+    from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
+    from langchain_experimental.text_splitter import SemanticChunker
+
+    logger.info("Creating chunks with strategy: %s", chunking_type)
+    logger.debug("Documents to chunk: %s", len(documents))
 
     try:
         if chunking_type == "text_splitter":
-            logger.debug(f"Using CharacterTextSplitter with size={chunk_size}, overlap={chunk_overlap}")
+            logger.debug("Using CharacterTextSplitter with size=%s, overlap=%s", chunk_size, chunk_overlap)
             text_splitter = CharacterTextSplitter(
                 chunk_size=chunk_size, chunk_overlap=chunk_overlap
             )
             chunked_documents = text_splitter.split_documents(documents)
             return chunked_documents
         elif chunking_type == "recursive":
-            logger.debug(f"Using RecursiveCharacterTextSplitter with size={chunk_size}, overlap={chunk_overlap}")
+            logger.debug("Using RecursiveCharacterTextSplitter with size=%s, overlap=%s", chunk_size, chunk_overlap)
             text_splitter = RecursiveCharacterTextSplitter(
                 chunk_size=chunk_size, chunk_overlap=chunk_overlap
             )
             chunked_documents = text_splitter.split_documents(documents)
             return chunked_documents
         elif chunking_type == "semantic_percentile":
-            logger.debug(f"Using SemanticChunker with percentile={percentile}")
+            logger.debug("Using SemanticChunker with percentile=%s", percentile)
             # Use the same embedding model as selected by user
             embed_model = initialize_embedding_model(embedding_model_name)
             semantic_chunker = SemanticChunker(embed_model, breakpoint_threshold_type="percentile",
@@ -215,7 +246,7 @@ def create_chunking(
             chunked_documents = semantic_chunker.split_documents(documents)
             return chunked_documents
         elif chunking_type == "semantic_interquartile":
-            logger.debug(f"Using SemanticChunker with interquartile factor={interquartile_range_factor}")
+            logger.debug("Using SemanticChunker with interquartile factor=%s", interquartile_range_factor)
             # Use the same embedding model as selected by user
             embed_model = initialize_embedding_model(embedding_model_name)
             semantic_chunker = SemanticChunker(embed_model, breakpoint_threshold_type="interquartile",
@@ -223,7 +254,7 @@ def create_chunking(
             chunked_documents = semantic_chunker.split_documents(documents)
             return chunked_documents
         elif chunking_type == "semantic_std_dev":
-            logger.debug(f"Using SemanticChunker with std_dev factor={standard_deviation_factor}")
+            logger.debug("Using SemanticChunker with std_dev factor=%s", standard_deviation_factor)
             # Use the same embedding model as selected by user
             embed_model = initialize_embedding_model(embedding_model_name)
             semantic_chunker = SemanticChunker(embed_model, breakpoint_threshold_type="standard_deviation",
@@ -231,7 +262,7 @@ def create_chunking(
             chunked_documents = semantic_chunker.split_documents(documents)
             return chunked_documents
         else:
-            logger.error(f"Invalid chunking type: {chunking_type}")
+            logger.error("Invalid chunking type: %s", chunking_type)
             raise ValueError(
                 "Invalid chunking type. Choose from 'text_splitter', 'recursive', 'semantic_percentile', 'semantic_interquartile', or 'semantic_std_dev'."
             )
@@ -239,7 +270,7 @@ def create_chunking(
         # logger.info(f"Created {len(chunked_documents)} chunks")
 
     except Exception as e:
-        logger.exception(f"Error creating chunks with strategy {chunking_type}: {str(e)}")
+        logger.exception("Error creating chunks with strategy %s: %s", chunking_type, str(e))
         raise
 
 def get_embedding_folder(embedding_model: str) -> str:
@@ -256,6 +287,42 @@ def get_faiss_index_path(kb_name: str, embedding_model: str) -> str:
     folder = get_embedding_folder(embedding_model)
     return f"{folder}/FAISS_Index/{kb_name}"
 
+# Written next to index.faiss by indexes that store unit-length vectors; older indexes hold raw vectors
+NORMALIZED_MARKER = "normalized_l2"
+
+
+def index_is_normalized(index_path: str) -> bool:
+    """Whether the FAISS index at index_path was built with normalize_L2."""
+    return os.path.exists(os.path.join(index_path, NORMALIZED_MARKER))
+
+
+def load_faiss_index(index_path: str, embedding_model_name: str):
+    """Load a saved FAISS index, reusing the loaded copy until the index is written again."""
+    # index.faiss is rewritten on every save, so its mtime tells a fresh index from a cached one
+    mtime = os.path.getmtime(os.path.join(index_path, "index.faiss"))
+    return _load_faiss_index(index_path, embedding_model_name.strip(), os.getenv("OPENAI_API_KEY"), mtime,
+                             index_is_normalized(index_path))
+
+
+@lru_cache(maxsize=16)
+def _load_faiss_index(index_path, embedding_model_name, api_key, mtime, normalized):
+    from langchain_community.vectorstores import FAISS
+
+    # Queries are normalised only when the stored vectors are, so older raw indexes keep their ranking
+    return FAISS.load_local(
+        folder_path=index_path,
+        embeddings=_create_embedding_model(embedding_model_name, api_key),
+        allow_dangerous_deserialization=True,
+        normalize_L2=normalized
+    )
+
+
+def _save_normalized_index(vectorstore, index_path):
+    os.makedirs(index_path, exist_ok=True)
+    vectorstore.save_local(index_path)
+    open(os.path.join(index_path, NORMALIZED_MARKER), "w").close()
+
+
 def get_automatic_chunking_strategy(embedding_model: str) -> str:
     """Get the automatic chunking strategy based on embedding model"""
     if embedding_model.startswith("text-embedding"):  # GPT/OpenAI models
@@ -266,6 +333,98 @@ def get_automatic_chunking_strategy(embedding_model: str) -> str:
         return "recursive"  # Default fallback
 
 
+def _load_documents(file):
+    """Load a PDF or DOCX upload into page-level LangChain documents."""
+    from langchain.schema import Document
+
+    file_name = file.name.lower()
+
+    # Load the file with page metadata
+    if file_name.endswith('.pdf'):
+        file_data = load_pdf_with_pages(file)
+        document_type = "pdf"
+    elif file_name.endswith('.docx'):
+        file_data = load_docx_with_pages(file)
+        document_type = "docx"
+    else:
+        logger.error("Unsupported file format: %s", file_name)
+        raise ValueError("Unsupported file format. Only PDF and DOCX are supported.")
+
+    # Convert the loaded data with page metadata into LangChain document format
+    total_pages = len(file_data["pages"])
+    documents = []
+    for page in file_data["pages"]:
+        documents.append(
+            Document(
+                page_content=page["page_content"],
+                metadata={
+                    "page": page["page_number"] - 1,
+                    "source": file_data["filename"],
+                    "total_pages": total_pages
+                }
+            )
+        )
+    logger.debug("Created %s document objects", len(documents))
+    return file_data, document_type, documents
+
+
+def _write_faiss_index(index_path, embedding_model, chunks, vectors):
+    """Add pre-computed chunk embeddings to the FAISS index at index_path, creating it if needed."""
+    # New indexes store unit-length vectors (normalize_L2) and are marked as such, so loads normalise
+    # queries too; L2 distance between unit vectors then ranks exactly like cosine similarity.
+    # Indexes built before the marker existed keep raw vectors, and appends to them stay raw
+    from langchain_community.vectorstores import FAISS
+
+    text_embeddings = list(zip([chunk.page_content for chunk in chunks], vectors))
+    metadatas = [chunk.metadata for chunk in chunks]
+
+    try:
+        if os.path.exists(index_path) and os.path.isdir(index_path):
+            # Try to update existing index
+            logger.info("Updating existing FAISS index at %s", index_path)
+            existing_vectorstore = FAISS.load_local(index_path, embedding_model,
+                                                    allow_dangerous_deserialization=True,
+                                                    normalize_L2=index_is_normalized(index_path))
+            existing_vectorstore.add_embeddings(text_embeddings, metadatas=metadatas)
+            existing_vectorstore.save_local(index_path)
+            logger.debug("Updated existing FAISS index with %s chunks", len(chunks))
+        else:
+            # Create new index
+            logger.info("Creating new FAISS index at %s", index_path)
+            # Build vectorstore first to avoid leaving empty directories on failure
+            vectorstore = FAISS.from_embeddings(text_embeddings, embedding_model, metadatas=metadatas,
+                                                normalize_L2=True)
+            _save_normalized_index(vectorstore, index_path)
+            logger.debug("Created new FAISS index with %s chunks", len(chunks))
+    except Exception as e:
+        # Handle specific FAISS errors
+        logger.exception("FAISS error: %s", str(e))
+        logger.info("Trying to create a new index due to error")
+
+        # Remove problematic directory if it exists
+        if os.path.exists(index_path):
+            try:
+                shutil.rmtree(index_path)
+                logger.debug("Removed problematic FAISS index directory: %s", index_path)
+            except Exception as rm_error:
+                logger.error("Failed to remove directory %s: %s", index_path, str(rm_error))
+
+        # Create a new clean index
+        # Build vectorstore first to avoid leaving empty directories on failure
+        vectorstore = FAISS.from_embeddings(text_embeddings, embedding_model, metadatas=metadatas,
+                                            normalize_L2=True)
+        _save_normalized_index(vectorstore, index_path)
+        logger.debug("Created new FAISS index with %s chunks after error recovery", len(chunks))
+
+
+def _error_result(e):
+    return {
+        "status": "error",
+        "message": str(e),
+        "traceback": traceback.format_exc()
+    }
+
+
 def process_and_chunk_file(
         file,
         kb_name,
@@ -276,16 +435,14 @@ def process_and_chunk_file(
         created_by="admin",
 ):
     """Process a file and chunk it into documents for indexing."""
-    logger.info(f"Processing file {file.name} for knowledge base {kb_name}")
+    logger.info("Processing file %s for knowledge base %s", file.name, kb_name)
 
     try:
         # Create model-specific directory structure
         embedding_folder = get_embedding_folder(embedding_model_name)
         base_path = f"{embedding_folder}/FAISS_Index"
         os.makedirs(base_path, exist_ok=True)
-        logger.debug(f"Ensured {base_path} directory exists")
-
-        file_name = file.name.lower()
+        logger.debug("Ensured %s directory exists", base_path)
 
         # Register knowledge base with embedding model info
         kb_id = register_knowledge_base(
@@ -294,34 +451,10 @@ def process_and_chunk_file(
             chunking_strategy=chunking_strategy_name,
             created_by=created_by
         )
-        logger.debug(f"Registered knowledge base with ID: {kb_id}")
-
-        # Load the file with page metadata
-        if file_name.endswith('.pdf'):
-            file_data = load_pdf_with_pages(file)
-            document_type = "pdf"
-        elif file_name.endswith('.docx'):
-            file_data = load_docx_with_pages(file)
-            document_type = "docx"
-        else:
-            logger.error(f"Unsupported file format: {file_name}")
-            raise ValueError("Unsupported file format. Only PDF and DOCX are supported.")
+        logger.debug("Registered knowledge base with ID: %s", kb_id)
 
-        # Convert the loaded data with page metadata into LangChain document format
+        file_data, document_type, documents = _load_documents(file)
         total_pages = len(file_data["pages"])
-        documents = []
-        for page in file_data["pages"]:
-            documents.append(
-                Document(
-                    page_content=page["page_content"],
-                    metadata={
-                        "page": page["page_number"] - 1,
-                        "source": file_data["filename"],
-                        "total_pages": total_pages
-                    }
-                )
-            )
-        logger.debug(f"Created {len(documents)} document objects")
 
         # Initialize embedding model
         embedding_model = initialize_embedding_model(embedding_model_name)
@@ -346,54 +479,20 @@ def process_and_chunk_file(
                 page_count=total_pages,
                 chunk_count=len(chunks)
             )
-            logger.debug(f"Registered document in database")
+            logger.debug("Registered document in database")
         except Exception as e:
             return e
 
         # Create or update FAISS index in model-specific folder
         index_path = get_faiss_index_path(kb_name, embedding_model_name)
-        logger.debug(f"Preparing FAISS index at: {index_path}")
+        logger.debug("Preparing FAISS index at: %s", index_path)
 
-        try:
-            if not chunks:
-                raise ValueError("No chunks were produced from the document; cannot build index")
-            if os.path.exists(index_path) and os.path.isdir(index_path):
-                # Try to update existing index
-                logger.info(f"Updating existing FAISS index at {index_path}")
-                existing_vectorstore = FAISS.load_local(index_path, embedding_model,
-                                                        allow_dangerous_deserialization=True)
-                existing_vectorstore.add_documents(chunks)
-                existing_vectorstore.save_local(index_path)
-                logger.debug(f"Updated existing FAISS index with {len(chunks)} chunks")
-            else:
-                # Create new index
-                logger.info(f"Creating new FAISS index at {index_path}")
-                # Build vectorstore first to avoid leaving empty directories on failure
-                vectorstore = FAISS.from_documents(documents=chunks, embedding=embedding_model)
-                os.makedirs(index_path, exist_ok=True)
-                vectorstore.save_local(index_path)
-                logger.debug(f"Created new FAISS index with {len(chunks)} chunks")
-        except Exception as e:
-            # Handle specific FAISS errors
-            logger.exception(f"FAISS error: {str(e)}")
-            logger.info("Trying to create a new index due to error")
-
-            # Remove problematic directory if it exists
-            if os.path.exists(index_path):
-                try:
-                    shutil.rmtree(index_path)
-                    logger.debug(f"Removed problematic FAISS index directory: {index_path}")
-                except Exception as rm_error:
-                    logger.error(f"Failed to remove directory {index_path}: {str(rm_error)}")
-
-            # Create a new clean index
-            # Build vectorstore first to avoid leaving empty directories on failure
-            vectorstore = FAISS.from_documents(documents=chunks, embedding=embedding_model)
-            os.makedirs(index_path, exist_ok=True)
-            vectorstore.save_local(index_path)
-            logger.debug(f"Created new FAISS index with {len(chunks)} chunks after error recovery")
+        if not chunks:
+            raise ValueError("No chunks were produced from the document; cannot build index")
+        vectors = embedding_model.embed_documents([chunk.page_content for chunk in chunks])
+        _write_faiss_index(index_path, embedding_model, chunks, vectors)
 
-        logger.info(f"Successfully processed file {file.name} with {len(chunks)} chunks")
+        logger.info("Successfully processed file %s with %s chunks", file.name, len(chunks))
         return {
             "status": "success",
             "filename": file_data["filename"],
@@ -402,48 +501,158 @@ def process_and_chunk_file(
             "kb_name": kb_name
         }
     except Exception as e:
-        logger.exception(f"Error processing file {file.name}: {str(e)}")
-        import traceback
-        return {
-            "status": "error", 
-            "message": str(e), 
-            "traceback": traceback.format_exc()
+        logger.exception("Error processing file %s: %s", file.name, str(e))
+        return _error_result(e)
+
+
+def _prepare_file_chunks(file, kb_name, embedding_model_name, chunking_strategy_name, chunk_size, chunk_overlap,
+                         created_by):
+    """Register the knowledge base for a file, load it and chunk it without embedding the chunks."""
+    logger.info("Chunking file %s for knowledge base %s", file.name, kb_name)
+    kb_id = register_knowledge_base(
+        name=kb_name,
+        embedding_model=embedding_model_name,
+        chunking_strategy=chunking_strategy_name,
+        created_by=created_by
+    )
+    file_data, document_type, documents = _load_documents(file)
+    chunks = create_chunking(
+        chunking_type=chunking_strategy_name,
+        documents=documents,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        embedding_model_name=embedding_model_name
+    )
+    if not chunks:
+        raise ValueError("No chunks were produced from the document; cannot build index")
+    return {
+        "kb_name": kb_name,
+        "kb_id": kb_id,
+        "file_data": file_data,
+        "document_type": document_type,
+        "chunks": chunks
+    }
+
+
+def process_and_chunk_files_batched(
+        files,
+        kb_names,
+        embedding_model_name,
+        chunking_strategy_name,
+        chunk_size=1000,
+        chunk_overlap=200,
+        created_by="admin",
+        batch_size=128,
+):
+    """Chunk several files, embed all of their chunks in shared batches and index each into its knowledge base.
+
+    Returns one result dict per file, in the same order as ``files``, shaped like process_and_chunk_file's.
+    """
+    logger.info("Batch processing %s files with %s", len(files), embedding_model_name)
+    results = [None] * len(files)
+    if not files:
+        return results
+
+    try:
+        os.makedirs(f"{get_embedding_folder(embedding_model_name)}/FAISS_Index", exist_ok=True)
+        embedding_model = initialize_embedding_model(embedding_model_name)
+        if isinstance(embedding_model, str):
+            raise ValueError(f"Invalid embedding model specified: {embedding_model_name}")
+    except Exception as e:
+        logger.exception("Error initializing batch processing: %s", str(e))
+        return [_error_result(e) for _ in files]
+
+    # Load and chunk the files concurrently; each file is independent until its index is written
+    prepared = []
+    with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+        futures = {
+            executor.submit(_prepare_file_chunks, file, kb_name, embedding_model_name, chunking_strategy_name,
+                            chunk_size, chunk_overlap, created_by): i
+            for i, (file, kb_name) in enumerate(zip(files, kb_names))
         }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                prepared.append((i, future.result()))
+            except Exception as e:
+                logger.exception("Error processing file %s: %s", files[i].name, str(e))
+                results[i] = _error_result(e)
+    prepared.sort(key=lambda entry: entry[0])
+
+    # Embed the chunks of every file together so requests are filled to batch_size
+    texts = [chunk.page_content for _, item in prepared for chunk in item["chunks"]]
+    try:
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embedding_model.embed_documents(texts[start:start + batch_size]))
+        logger.debug("Embedded %s chunks in batches of %s", len(texts), batch_size)
+    except Exception as e:
+        logger.exception("Error embedding chunks: %s", str(e))
+        for i, _ in prepared:
+            results[i] = _error_result(e)
+        return results
+
+    offset = 0
+    for i, item in prepared:
+        chunks = item["chunks"]
+        file_vectors = vectors[offset:offset + len(chunks)]
+        offset += len(chunks)
+        file_data = item["file_data"]
+        try:
+            register_document(
+                knowledge_base_id=item["kb_id"],
+                filename=file_data["filename"],
+                document_type=item["document_type"],
+                page_count=len(file_data["pages"]),
+                chunk_count=len(chunks)
+            )
+            _write_faiss_index(get_faiss_index_path(item["kb_name"], embedding_model_name), embedding_model,
+                               chunks, file_vectors)
+            logger.info("Successfully processed file %s with %s chunks", file_data['filename'], len(chunks))
+            results[i] = {
+                "status": "success",
+                "filename": file_data["filename"],
+                "page_count": len(file_data["pages"]),
+                "chunk_count": len(chunks),
+                "kb_name": item["kb_name"]
+            }
+        except Exception as e:
+            logger.exception("Error indexing file %s: %s", file_data['filename'], str(e))
+            results[i] = _error_result(e)
 
-def retrieve_documents(kb_name: str, embedding_model_name: str, query: str, k: int = 4) -> List[Document]:
+    return results
+
+def retrieve_documents(kb_name: str, embedding_model_name: str, query: str, k: int = 4) -> List["Document"]:
     """Retrieve relevant documents for a query."""
-    logger.info(f"Retrieving documents for query from KB: {kb_name}")
+    logger.info("Retrieving documents for query from KB: %s", kb_name)
     
     try:
         path = f"FAISS_Index/{kb_name}"
         if not os.path.exists(path):
-            logger.error(f"Knowledge base directory does not exist: {path}")
+            logger.error("Knowledge base directory does not exist: %s", path)
             raise ValueError(f"Knowledge base '{kb_name}' does not exist at path: {path}")
             
-        embeddings = initialize_embedding_model(embedding_model_name)
-        vectorstore = FAISS.load_local(
-            folder_path=path, 
-            embeddings=embeddings, 
-            allow_dangerous_deserialization=True
-        )
-        logger.debug(f"Loaded FAISS index from: {path}")
+        vectorstore = load_faiss_index(path, embedding_model_name)
+        logger.debug("Loaded FAISS index from: %s", path)
         
         docs_and_scores = vectorstore.similarity_search_with_score(query, k=k)
-        logger.debug(f"Retrieved {len(docs_and_scores)} documents with scores")
+        logger.debug("Retrieved %s documents with scores", len(docs_and_scores))
 
-        for doc, score in docs_and_scores:
-            normalized_score = 1 / (1 + float(score))
-            doc.metadata['score'] = normalized_score
+        from langchain.schema import Document
 
-        return [doc for doc, _ in docs_and_scores]
+        # Annotate copies; the documents belong to the shared cached index
+        return [
+            Document(page_content=doc.page_content, metadata={**doc.metadata, 'score': 1 / (1 + float(score))})
+            for doc, score in docs_and_scores
+        ]
     except Exception as e:
-        logger.exception(f"Error retrieving documents: {str(e)}")
+        logger.exception("Error retrieving documents: %s", str(e))
         raise Exception(f"Error retrieving documents: {str(e)}")
 
 
 def get_retriever(kb_name: str, embedding_model_name: str, k: int = 16, search_type: str = "mmr"):
     """Get a retriever for the specified index."""
-    logger.info(f"Creating retriever for KB: {kb_name}")
+    logger.info("Creating retriever for KB: %s", kb_name)
 
     try:
         # Use model-specific path
@@ -451,28 +660,21 @@ def get_retriever(kb_name: str, embedding_model_name: str, k: int = 16, search_t
 
         # Detailed validation of the knowledge base directory
         if not os.path.exists(path):
-            logger.error(f"Knowledge base path does not exist: {path}")
+            logger.error("Knowledge base path does not exist: %s", path)
             raise ValueError(f"Knowledge base '{kb_name}' does not exist at path: {path}")
 
         if not os.path.isdir(path):
-            logger.error(f"Knowledge base path is not a directory: {path}")
+            logger.error("Knowledge base path is not a directory: %s", path)
             raise ValueError(f"Knowledge base path '{path}' exists but is not a directory")
 
         # Check if directory is empty
         if not os.listdir(path):
-            logger.error(f"Knowledge base directory is empty: {path}")
+            logger.error("Knowledge base directory is empty: %s", path)
             raise ValueError(f"Knowledge base directory '{path}' exists but is empty")
 
-        # Initialize embedding model
-        embeddings = initialize_embedding_model(embedding_model_name)
-
         # Load the vectorstore
-        vectorstore = FAISS.load_local(
-            folder_path=path,
-            embeddings=embeddings,
-            allow_dangerous_deserialization=True
-        )
-        logger.debug(f"Loaded FAISS index from: {path}")
+        vectorstore = load_faiss_index(path, embedding_model_name)
+        logger.debug("Loaded FAISS index from: %s", path)
 
         # Get retriever
         retriever = vectorstore.as_retriever(
@@ -481,11 +683,11 @@ def get_retriever(kb_name: str, embedding_model_name: str, k: int = 16, search_t
             fetch_k=k * 2
         )
 
-        logger.debug(f"Created retriever with search_type={search_type}, k={k}")
+        logger.debug("Created retriever with search_type=%s, k=%s", search_type, k)
 
         return retriever
     except Exception as e:
-        logger.exception(f"Failed to get retriever for {kb_name}: {str(e)}")
+        logger.exception("Failed to get retriever for %s: %s", kb_name, str(e))
         raise Exception(f"Error getting retriever: {str(e)}")
 
 def auto_create_knowledge_base_if_needed(embedding_model_name: str = "text-embedding-3-small") -> str:
@@ -498,7 +700,7 @@ def auto_create_knowledge_base_if_needed(embedding_model_name: str = "text-embed
     if not kbs:
         # Create a default knowledge base
         kb_name = "default_knowledge_base"
-        logger.info(f"No knowledge bases found, creating default: {kb_name}")
+        logger.info("No knowledge bases found, creating default: %s", kb_name)
         
         kb_id = register_knowledge_base(
             name=kb_name,
@@ -511,12 +713,12 @@ def auto_create_knowledge_base_if_needed(embedding_model_name: str = "text-embed
         # Create an empty FAISS index directory for this knowledge base
         index_path = f"FAISS_Index/{kb_name}"
         os.makedirs(index_path, exist_ok=True)
-        logger.debug(f"Created empty index directory: {index_path}")
+        logger.debug("Created empty index directory: %s", index_path)
         
         return kb_name
     
     # Return the first knowledge base name
-    logger.info(f"Using existing knowledge base: {kbs[0]['name']}")
+    logger.info("Using existing knowledge base: %s", kbs[0]['name'])
     return kbs[0]["name"]
 
 def get_all_knowledge_base_names() -> List[str]:
@@ -524,13 +726,13 @@ def get_all_knowledge_base_names() -> List[str]:
     logger.debug("Getting all knowledge base names")
     kbs = get_knowledge_bases()
     names = [kb["name"] for kb in kbs]
-    logger.debug(f"Found {len(names)} knowledge bases")
+    logger.debug("Found %s knowledge bases", len(names))
     return names
 
 def kb_exists(kb_name: str) -> bool:
     """Check if a knowledge base exists."""
     exists = os.path.exists(f"FAISS_Index/{kb_name}")
-    logger.debug(f"Checking if knowledge base {kb_name} exists: {exists}")
+    logger.debug("Checking if knowledge base %s exists: %s", kb_name, exists)
     return exists
 
 
@@ -540,17 +742,17 @@ def get_compatible_knowledge_bases(embedding_model: str) -> List[str]:
     faiss_path = f"{embedding_folder}/FAISS_Index"
 
     if not os.path.exists(faiss_path):
-        logger.debug(f"No FAISS directory found for {embedding_model} at {faiss_path}")
+        logger.debug("No FAISS directory found for %s at %s", embedding_model, faiss_path)
         return []
 
     try:
         # Get all directories in the embedding-specific folder
         kb_names = [name for name in os.listdir(faiss_path)
                     if os.path.isdir(os.path.join(faiss_path, name))]
-        logger.debug(f"Found {len(kb_names)} compatible KBs for {embedding_model}: {kb_names}")
+        logger.debug("Found %s compatible KBs for %s: %s", len(kb_names), embedding_model, kb_names)
         return kb_names
     except Exception as e:
-        logger.error(f"Error getting compatible KBs for {embedding_model}: {e}")
+        logger.error("Error getting compatible KBs for %s: %s", embedding_model, e)
         return []
 def migrate_existing_kbs():
     """Migrate existing FAISS indexes to new folder structure"""
@@ -573,7 +775,7 @@ def migrate_existing_kbs():
             embedding_model = get_kb_embedding_model(kb_name)
 
             if not embedding_model:
-                logger.warning(f"Could not find embedding model for {kb_name}, assuming llama3.2:latest")
+                logger.warning("Could not find embedding model for %s, assuming llama3.2:latest", kb_name)
                 embedding_model = "llama3.2:latest"
 
             # Create new path
@@ -583,10 +785,10 @@ def migrate_existing_kbs():
             # Move the KB to new location
             os.makedirs(os.path.dirname(new_path), exist_ok=True)
             shutil.move(old_kb_path, new_path)
-            logger.info(f"Migrated {kb_name} to {new_path}")
+            logger.info("Migrated %s to %s", kb_name, new_path)
 
         except Exception as e:
-            logger.error(f"Error migrating {kb_name}: {e}")
+            logger.error("Error migrating %s: %s", kb_name, e)
 
     # Remove old directory if empty
     try:
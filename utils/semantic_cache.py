@@ -0,0 +1,101 @@
+"""In-memory semantic answer cache for the RAG Chatbot."""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("rag-chatbot.semantic_cache")
+
+
+class SemanticCache:
+    """Answers keyed by query embedding, grouped by scope (conversation, knowledge bases and models).
+
+    A lookup hits when a cached query in the same scope has cosine similarity >= threshold with the new
+    one. Entries expire after ttl_seconds and the least recently used ones are evicted beyond max_size.
+    Safe to share between sessions and worker threads.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_size: int = 2000, ttl_seconds: float = 7 * 24 * 3600):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # scope -> {"vectors": (n, dim) float32 matrix of unit rows, "entries": [entry dict per row]}
+        self._scopes: Dict[Hashable, Dict[str, Any]] = {}
+        self._size = 0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope: Hashable, query_vector) -> Optional[Dict[str, Any]]:
+        """Return the cached {"content", "sources"} for the closest matching query, or None."""
+        query = self._unit(query_vector)
+        now = time.time()
+        with self._lock:
+            self._expire(scope, now)
+            bucket = self._scopes.get(scope)
+            if bucket is None or bucket["vectors"].shape[1] != query.shape[0]:
+                return None
+            # Rows are unit length, so one matrix-vector product gives every cosine similarity
+            scores = bucket["vectors"] @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            entry = bucket["entries"][best]
+            entry["last_used"] = now
+            logger.debug("Semantic cache hit with similarity %.4f", scores[best])
+            return {"content": entry["content"], "sources": entry["sources"]}
+
+    def add(self, scope: Hashable, query_vector, content: str, sources: List[Dict[str, Any]]) -> None:
+        query = self._unit(query_vector)
+        now = time.time()
+        entry = {"content": content, "sources": sources, "created": now, "last_used": now}
+        with self._lock:
+            bucket = self._scopes.get(scope)
+            if bucket is None or bucket["vectors"].shape[1] != query.shape[0]:
+                if bucket is not None:
+                    self._size -= len(bucket["entries"])
+                bucket = self._scopes[scope] = {"vectors": query[np.newaxis, :], "entries": [entry]}
+            else:
+                bucket["vectors"] = np.vstack([bucket["vectors"], query])
+                bucket["entries"].append(entry)
+            self._size += 1
+            while self._size > self.max_size:
+                self._evict_least_recently_used()
+
+    def drop_scopes(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Forget every scope for which predicate(scope) is true, e.g. after its knowledge bases changed."""
+        with self._lock:
+            for scope in [scope for scope in self._scopes if predicate(scope)]:
+                self._remove(scope, [])
+
+    def _expire(self, scope: Hashable, now: float) -> None:
+        bucket = self._scopes.get(scope)
+        if bucket is None:
+            return
+        keep = [i for i, entry in enumerate(bucket["entries"]) if now - entry["created"] < self.ttl_seconds]
+        if len(keep) != len(bucket["entries"]):
+            self._remove(scope, keep)
+
+    def _evict_least_recently_used(self) -> None:
+        scope, row = min(
+            ((scope, i) for scope, bucket in self._scopes.items() for i in range(len(bucket["entries"]))),
+            key=lambda item: self._scopes[item[0]]["entries"][item[1]]["last_used"]
+        )
+        keep = [i for i in range(len(self._scopes[scope]["entries"])) if i != row]
+        self._remove(scope, keep)
+
+    def _remove(self, scope: Hashable, keep: List[int]) -> None:
+        bucket = self._scopes[scope]
+        self._size -= len(bucket["entries"]) - len(keep)
+        if not keep:
+            del self._scopes[scope]
+            return
+        bucket["vectors"] = bucket["vectors"][keep]
+        bucket["entries"] = [bucket["entries"][i] for i in keep]